@@ -0,0 +1,91 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import zlib
+from datetime import datetime, timedelta
+
+from common import LoggerFactory
+from fastapi_sqlalchemy import db
+from sqlalchemy import or_, select
+
+from app.commons.psql_services import in_request
+from app.config import ConfigClass
+from app.models.copy_request_sql import EntityModel, RequestArchiveModel, RequestModel
+
+logger = LoggerFactory('cold_archive').get_logger()
+
+
+def compress_entities(rows: list[dict]) -> bytes:
+    # uuids and timestamps are stored as strings, Postgres casts them back on insert
+    return zlib.compress(json.dumps(rows, default=str).encode())
+
+
+def decompress_entities(data: bytes) -> list[dict]:
+    return json.loads(zlib.decompress(data))
+
+
+def archive_request(request_obj: RequestModel) -> int:
+    """Move the entities of a request into one compressed archive row and leave the request row as a stub."""
+    table = EntityModel.__table__
+    rows = [dict(row) for row in db.session.execute(select(table).where(in_request(request_obj.id))).mappings()]
+    db.session.add(RequestArchiveModel(
+        request_id=request_obj.id,
+        entity_count=len(rows),
+        entities=compress_entities(rows),
+    ))
+    db.session.execute(table.delete().where(in_request(request_obj.id)))
+    request_obj.cold_archived_at = datetime.utcnow()
+    db.session.commit()
+    logger.info(f'Archived {len(rows)} entities of request {request_obj.id}')
+    return len(rows)
+
+
+def rehydrate_request(request_obj: RequestModel) -> int:
+    """Restore the entities of an archived request, a no-op for requests that are not archived."""
+    if request_obj is None or request_obj.cold_archived_at is None:
+        return 0
+    # The lock keeps concurrent readers from restoring the same archive twice
+    archive = db.session.query(RequestArchiveModel).with_for_update().get(request_obj.id)
+    if archive is None:
+        db.session.rollback()
+        db.session.refresh(request_obj)
+        return 0
+    rows = decompress_entities(archive.entities)
+    batch_size = ConfigClass.ENTITY_INSERT_BATCH_SIZE
+    for i in range(0, len(rows), batch_size):
+        db.session.execute(EntityModel.__table__.insert(), rows[i:i + batch_size])
+    db.session.delete(archive)
+    request_obj.cold_archived_at = None
+    request_obj.rehydrated_at = datetime.utcnow()
+    db.session.commit()
+    logger.info(f'Rehydrated {len(rows)} entities of request {request_obj.id}')
+    return len(rows)
+
+
+def archive_completed_requests(limit: int) -> int:
+    """Archive requests completed more than COLD_ARCHIVE_AFTER_DAYS ago, one transaction per request.
+
+    A rehydrated request is read again, it's only archived once it hasn't been rehydrated for as long.
+    """
+    completed_before = datetime.utcnow() - timedelta(days=ConfigClass.COLD_ARCHIVE_AFTER_DAYS)
+    requests = db.session.query(RequestModel).filter(
+        RequestModel.status == 'complete',
+        RequestModel.completed_at < completed_before,
+        RequestModel.cold_archived_at.is_(None),
+        or_(RequestModel.rehydrated_at.is_(None), RequestModel.rehydrated_at < completed_before),
+    ).limit(limit).all()
+    for request_obj in requests:
+        archive_request(request_obj)
+    return len(requests)
@@ -0,0 +1,36 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+from typing import Any, Awaitable
+
+
+async def gather_with_concurrency(limit: int, *aws: Awaitable) -> list[Any]:
+    """Await all awaitables with at most `limit` running at once, results keep the input order.
+
+    If one of them fails the others are cancelled before the error is raised.
+    """
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw: Awaitable) -> Any:
+        async with semaphore:
+            return await aw
+
+    tasks = [asyncio.ensure_future(run(aw)) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
@@ -0,0 +1,51 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import httpx
+
+from app.config import ConfigClass
+
+SERVICES = ('auth', 'dataops', 'email', 'metadata')
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def _create_client(service: str) -> httpx.AsyncClient:
+    prefix = service.upper()
+    limits = httpx.Limits(
+        max_connections=getattr(ConfigClass, f'{prefix}_MAX_CONNECTIONS'),
+        max_keepalive_connections=getattr(ConfigClass, f'{prefix}_MAX_CONNECTIONS'),
+        keepalive_expiry=ConfigClass.HTTP_KEEPALIVE_EXPIRY,
+    )
+    timeout = httpx.Timeout(getattr(ConfigClass, f'{prefix}_TIMEOUT'))
+    return httpx.AsyncClient(limits=limits, timeout=timeout, http2=ConfigClass.HTTP2_ENABLED)
+
+
+def get_client(service: str) -> httpx.AsyncClient:
+    """Return the pooled client of a downstream service, created on first use."""
+    client = _clients.get(service)
+    if client is None or client.is_closed:
+        client = _create_client(service)
+        _clients[service] = client
+    return client
+
+
+def open_clients():
+    for service in SERVICES:
+        get_client(service)
+
+
+async def close_clients():
+    for service in list(_clients):
+        await _clients.pop(service).aclose()
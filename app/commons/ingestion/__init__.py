@@ -0,0 +1,141 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import time
+from uuid import UUID
+
+from common import LoggerFactory
+from fastapi_sqlalchemy import db
+
+from app.commons.concurrency import gather_with_concurrency
+from app.commons.ingestion.jobs import IngestionProgress
+from app.commons.meta_services import iter_files_recursive
+from app.commons.psql_services import (
+    complete_checkpoint,
+    count_entities,
+    count_folder_files,
+    create_top_level_entities,
+    fail_ingestion,
+    finish_ingestion,
+    get_checkpoints,
+    number_entities,
+    save_page,
+    summarize_request,
+)
+from app.config import ConfigClass
+from app.models.copy_request_sql import IngestionCheckpointModel, RequestModel
+
+logger = LoggerFactory('ingestion').get_logger()
+
+
+def node_path(entity: dict) -> tuple[str, ...]:
+    # Only the parent path is dot separated, names may contain dots themselves
+    parents = entity['parent_path'].split('.') if entity['parent_path'] else []
+    return (entity['container_code'], entity['zone'], *parents, entity['name'])
+
+
+def normalize_selection(entities: list[dict]) -> list[dict]:
+    """Drop duplicate entities and entities inside a selected folder, so only maximal subtrees are expanded."""
+    unique = list({entity['id']: entity for entity in entities}.values())
+    folder_paths = set()
+    kept_ids = set()
+    for entity in sorted(unique, key=lambda e: len(node_path(e))):
+        path = node_path(entity)
+        # Every strict prefix below container and zone may be a selected ancestor folder
+        if any(path[:depth] in folder_paths for depth in range(3, len(path))):
+            continue
+        kept_ids.add(entity['id'])
+        if entity['type'] == 'folder':
+            folder_paths.add(path)
+    return [entity for entity in unique if entity['id'] in kept_ids]
+
+
+async def ingest_subtree(
+    request_id: str,
+    entity: dict,
+    checkpoint: IngestionCheckpointModel,
+    progress: IngestionProgress = None,
+) -> int:
+    # Each page is written as soon as it arrives so only one page per subtree is held in memory
+    count = 0
+    first_page = True
+    async for page in iter_files_recursive(entity, start_page=checkpoint.next_page):
+        save_page(request_id, checkpoint, page.items, page.page + 1)
+        count += len(page.items)
+        if progress:
+            if first_page and page.total:
+                progress.add_total(page.total - page.page * ConfigClass.META_SEARCH_PAGE_SIZE)
+            progress.add_page(page.items)
+            await progress.save()
+        first_page = False
+    complete_checkpoint(request_id, checkpoint)
+    return count
+
+
+async def ingest_entities(request_id: str, entities: list[dict], progress: IngestionProgress = None) -> int:
+    """Write the selected entities and stream all of their sub files/folders into approval_entity.
+
+    Progress is checkpointed per page, calling it again for the same request continues where the last run stopped.
+    """
+    start = time.perf_counter()
+    total = 0
+    entities = normalize_selection(entities)
+    checkpoints = get_checkpoints(request_id)
+    if checkpoints:
+        existing, size = count_entities(request_id)
+        logger.info(f'Resuming ingestion of request {request_id}, {existing} entities already ingested')
+        if progress:
+            progress.add_existing(existing, size)
+    else:
+        for entity in entities:
+            entity['parent'] = None
+        checkpoints = create_top_level_entities(request_id, entities)
+        total += len(entities)
+        if progress:
+            progress.add_total(len(entities))
+            progress.add_page(entities)
+
+    if progress:
+        await progress.save()
+    subtrees = []
+    for entity in entities:
+        checkpoint = checkpoints.get(UUID(entity['id']))
+        if checkpoint and not checkpoint.completed:
+            subtrees.append(ingest_subtree(request_id, entity, checkpoint, progress))
+    counts = await gather_with_concurrency(ConfigClass.META_SERVICE_CONCURRENCY, *subtrees)
+    total += sum(counts)
+    # Numbered once the whole tree is in, it's committed together with the status change
+    number_entities(request_id)
+    count_folder_files(request_id)
+    summarize_request(request_id)
+
+    elapsed = time.perf_counter() - start
+    rate = total / elapsed if elapsed else total
+    logger.info(f'Ingested {total} entities for request {request_id} in {elapsed:.2f}s ({rate:.0f} rows/s)')
+    return total
+
+
+async def ingest_request(request_obj: RequestModel, entities: list[dict], progress: IngestionProgress = None):
+    """Ingest a claimed request and make it available for review, a failed request can be resumed later."""
+    request_id = request_obj.id
+    try:
+        await ingest_entities(request_id, entities, progress)
+    except Exception:
+        db.session.rollback()
+        logger.exception(f'Ingestion of request {request_id} failed')
+        fail_ingestion(request_id)
+        raise
+    if not finish_ingestion(request_id):
+        logger.info(f'Request {request_id} was marked for deletion during its ingestion')
+    db.session.refresh(request_obj)
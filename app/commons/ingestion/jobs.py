@@ -0,0 +1,107 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import time
+from typing import Optional
+
+from aioredis import StrictRedis
+
+from app.config import ConfigClass
+
+INGESTION_QUEUE = 'approval:ingestion:queue'
+# Jobs stay here while a worker runs them, so a crashed worker's jobs can be queued again
+INGESTION_PROCESSING = 'approval:ingestion:processing'
+PROGRESS_FIELDS = ('files_total', 'files_ingested', 'bytes_ingested')
+
+redis = StrictRedis.from_url(ConfigClass.REDIS_URI, decode_responses=True)
+
+
+def progress_key(request_id: str) -> str:
+    return f'approval:ingestion:{request_id}'
+
+
+async def enqueue_ingestion(request_id: str, entity_ids: list[str]):
+    job = {'request_id': str(request_id), 'entity_ids': entity_ids}
+    await IngestionProgress(request_id).save()
+    await redis.lpush(INGESTION_QUEUE, json.dumps(job))
+
+
+async def dequeue_ingestion(timeout: int = None) -> Optional[str]:
+    """Move the next job to the processing list and return it as queued, it stays there until it's acked."""
+    if timeout is None:
+        timeout = ConfigClass.INGESTION_POLL_TIMEOUT
+    return await redis.brpoplpush(INGESTION_QUEUE, INGESTION_PROCESSING, timeout=timeout)
+
+
+async def ack_ingestion(item: str):
+    await redis.lrem(INGESTION_PROCESSING, 1, item)
+
+
+async def get_unacked_ingestions() -> list[str]:
+    return await redis.lrange(INGESTION_PROCESSING, 0, -1)
+
+
+async def requeue_ingestion(item: str):
+    async with redis.pipeline(transaction=True) as pipe:
+        await pipe.lrem(INGESTION_PROCESSING, 1, item).lpush(INGESTION_QUEUE, item).execute()
+
+
+class IngestionProgress:
+    """Counters for a running ingestion, kept in a redis hash so any API worker can report them."""
+
+    def __init__(self, request_id: str):
+        self.request_id = str(request_id)
+        self.files_total = 0
+        self.files_ingested = 0
+        self.bytes_ingested = 0
+        self.started_at = time.time()
+
+    def add_existing(self, count: int, size: int):
+        self.files_total += count
+        self.files_ingested += count
+        self.bytes_ingested += size
+
+    def add_total(self, total: Optional[int]):
+        if total:
+            self.files_total += total
+
+    def add_page(self, entities: list[dict]):
+        self.files_ingested += len(entities)
+        self.bytes_ingested += sum(entity.get('size') or 0 for entity in entities)
+
+    async def save(self, error: str = ''):
+        mapping = {
+            'files_total': self.files_total,
+            'files_ingested': self.files_ingested,
+            'bytes_ingested': self.bytes_ingested,
+            'started_at': self.started_at,
+            'error': error,
+        }
+        key = progress_key(self.request_id)
+        await redis.hset(key, mapping=mapping)
+        await redis.expire(key, ConfigClass.INGESTION_PROGRESS_TTL)
+
+
+async def get_progress(request_id: str) -> dict:
+    progress = await redis.hgetall(progress_key(request_id))
+    result = {field: int(progress.get(field, 0)) for field in PROGRESS_FIELDS}
+    result['error'] = progress.get('error', '')
+    result['eta_seconds'] = None
+    if progress.get('started_at') and result['files_ingested']:
+        elapsed = time.time() - float(progress['started_at'])
+        remaining = result['files_total'] - result['files_ingested']
+        if remaining > 0:
+            result['eta_seconds'] = round(remaining / (result['files_ingested'] / elapsed))
+    return result
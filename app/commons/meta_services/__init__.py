@@ -12,46 +12,99 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from typing import List
-
-import httpx
+from typing import AsyncIterator, List, NamedTuple, Optional
 
+from app.commons.concurrency import gather_with_concurrency
+from app.commons.http_clients import get_client
+from app.commons.meta_services.cache import node_cache
 from app.config import ConfigClass
 from app.models.base import EAPIResponseCode
 from app.resources.error_handler import APIException
 
 
-def get_node_by_id(entity_id: str) -> dict:
-    response = httpx.get(ConfigClass.META_SERVICE + f'item/{entity_id}/')
+class SearchPage(NamedTuple):
+    page: int
+    total: Optional[int]
+    items: List[dict]
+
+
+async def get_node_by_id(entity_id: str, use_cache: bool = True) -> dict:
+    if use_cache:
+        cached = await node_cache.get_many([entity_id])
+        if entity_id in cached:
+            return cached[entity_id]
+
+    client = get_client('metadata')
+    response = await client.get(ConfigClass.META_SERVICE + f'item/{entity_id}/')
     if response.status_code != 200:
         error_msg = f'Error calling Meta service get_node_by_id: {response.json()}'
         raise APIException(error_msg=error_msg, status_code=EAPIResponseCode.internal_error.value)
     if not response.json()['result']:
         error_msg = 'Folder not found'
         raise APIException(error_msg=error_msg, status_code=EAPIResponseCode.not_found.value)
-    return response.json()['result']
+    node = response.json()['result']
+    await node_cache.set_many([node])
+    return node
+
 
+async def bulk_get_by_ids(ids: List[str], use_cache: bool = True) -> List[dict]:
+    """Return the nodes of the ids in the order they were asked for, cached ones aren't fetched again."""
+    ids = list(dict.fromkeys(ids))
+    nodes = await node_cache.get_many(ids) if use_cache else {}
+    missing_ids = [node_id for node_id in ids if node_id not in nodes]
+    # Large id sets are split so the query string stays small
+    batch_size = ConfigClass.META_BATCH_SIZE
+    chunks = await gather_with_concurrency(
+        ConfigClass.META_SERVICE_CONCURRENCY,
+        *(fetch_by_ids(missing_ids[i:i + batch_size]) for i in range(0, len(missing_ids), batch_size)),
+    )
+    for fetched in chunks:
+        await node_cache.set_many(fetched)
+        nodes.update((node['id'], node) for node in fetched)
+    requested = set(ids)
+    # Nodes the service returned under an id that wasn't asked for are kept at the end
+    extra = [node for node_id, node in nodes.items() if node_id not in requested]
+    return [nodes[node_id] for node_id in ids if node_id in nodes] + extra
 
-def bulk_get_by_ids(ids: List[str]) -> List[dict]:
+
+async def fetch_by_ids(ids: List[str]) -> List[dict]:
     query_data = {'ids': ids}
-    response = httpx.get(ConfigClass.META_SERVICE + 'items/batch/', params=query_data)
+    client = get_client('metadata')
+    response = await client.get(ConfigClass.META_SERVICE + 'items/batch/', params=query_data)
     if response.status_code != 200:
         error_msg = f'Error calling Meta service bulk_get_by_ids: {response.json()}'
         raise APIException(error_msg=error_msg, status_code=EAPIResponseCode.internal_error.value)
     return response.json()['result']
 
 
-def get_files_recursive(entity: dict) -> list:
+async def iter_files_recursive(entity: dict, page_size: int = None, start_page: int = 0) -> AsyncIterator[SearchPage]:
+    """Yield every node under the entity one page at a time, starting from `start_page`."""
+    if not page_size:
+        page_size = ConfigClass.META_SEARCH_PAGE_SIZE
+
     parent_path = entity['parent_path']
     name = entity['name']
     query_data = {
         'container_code': entity['container_code'],
         'zone': entity['zone'],
         'recursive': True,
-        'parent_path': f'{parent_path}.{name}'
+        'parent_path': f'{parent_path}.{name}',
+        'sorting': 'created_time',
+        'order': 'asc',
+        'page_size': page_size,
     }
-    response = httpx.get(ConfigClass.META_SERVICE + 'items/search/', params=query_data)
-    if response.status_code != 200:
-        error_msg = f'Error calling Meta service get_files_recursive: {response.json()}'
-        raise APIException(error_msg=error_msg, status_code=EAPIResponseCode.internal_error.value)
-    return response.json()['result']
+    page = start_page
+    client = get_client('metadata')
+    while True:
+        query_data['page'] = page
+        response = await client.get(ConfigClass.META_SERVICE + 'items/search/', params=query_data)
+        if response.status_code != 200:
+            error_msg = f'Error calling Meta service iter_files_recursive: {response.json()}'
+            raise APIException(error_msg=error_msg, status_code=EAPIResponseCode.internal_error.value)
+        result = response.json()
+        if result['result']:
+            yield SearchPage(page, result.get('total'), result['result'])
+        num_of_pages = result.get('num_of_pages')
+        if len(result['result']) < page_size or (num_of_pages is not None and page + 1 >= num_of_pages):
+            break
+        page += 1
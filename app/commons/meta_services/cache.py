@@ -0,0 +1,135 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import time
+from collections import OrderedDict
+from typing import Iterable
+
+from aioredis import StrictRedis
+from common import LoggerFactory
+
+from app.config import ConfigClass
+
+logger = LoggerFactory('meta_cache').get_logger()
+
+
+class NodeCache:
+    """Two tier cache of metadata nodes, an in-process LRU with TTL in front of a redis tier shared by all workers.
+
+    Nodes are stored serialized so callers can modify what they get back. Redis errors are logged and treated as a
+    miss so the metadata service stays the source of truth.
+    """
+
+    def __init__(self, max_size: int, ttl: int, redis_ttl: int, redis_enabled: bool):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.redis_ttl = redis_ttl
+        self.redis = None
+        if redis_enabled:
+            self.redis = StrictRedis.from_url(
+                ConfigClass.REDIS_URI, decode_responses=True, socket_timeout=1, socket_connect_timeout=1
+            )
+        self._local: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.local_hits = 0
+        self.redis_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(node_id: str) -> str:
+        return f'approval:meta:node:{node_id}'
+
+    def _get_local(self, node_id: str):
+        item = self._local.get(node_id)
+        if item is None:
+            return None
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._local[node_id]
+            return None
+        self._local.move_to_end(node_id)
+        return value
+
+    def _set_local(self, node_id: str, value: str):
+        self._local[node_id] = (time.monotonic() + self.ttl, value)
+        self._local.move_to_end(node_id)
+        while len(self._local) > self.max_size:
+            self._local.popitem(last=False)
+
+    async def get_many(self, node_ids: Iterable[str]) -> dict[str, dict]:
+        found = {}
+        remote_ids = []
+        for node_id in node_ids:
+            value = self._get_local(node_id)
+            if value is None:
+                remote_ids.append(node_id)
+            else:
+                found[node_id] = json.loads(value)
+                self.local_hits += 1
+
+        if remote_ids and self.redis:
+            try:
+                values = await self.redis.mget([self._key(node_id) for node_id in remote_ids])
+            except Exception as e:
+                logger.warning(f'Redis node cache unavailable: {e}')
+                values = [None] * len(remote_ids)
+            for node_id, value in zip(remote_ids, values):
+                if value is not None:
+                    found[node_id] = json.loads(value)
+                    self._set_local(node_id, value)
+                    self.redis_hits += 1
+        self.misses += sum(1 for node_id in remote_ids if node_id not in found)
+        return found
+
+    async def set_many(self, nodes: list[dict]):
+        values = {node['id']: json.dumps(node) for node in nodes}
+        for node_id, value in values.items():
+            self._set_local(node_id, value)
+        if values and self.redis:
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for node_id, value in values.items():
+                        pipe.setex(self._key(node_id), self.redis_ttl, value)
+                    await pipe.execute()
+            except Exception as e:
+                logger.warning(f'Redis node cache unavailable: {e}')
+
+    async def invalidate(self, node_ids: Iterable[str]):
+        node_ids = list(node_ids)
+        for node_id in node_ids:
+            self._local.pop(node_id, None)
+        if node_ids and self.redis:
+            try:
+                await self.redis.delete(*[self._key(node_id) for node_id in node_ids])
+            except Exception as e:
+                logger.warning(f'Redis node cache unavailable: {e}')
+
+    def clear(self):
+        self._local.clear()
+
+    def stats(self) -> dict:
+        return {
+            'local_hits': self.local_hits,
+            'redis_hits': self.redis_hits,
+            'misses': self.misses,
+            'local_size': len(self._local),
+        }
+
+
+node_cache = NodeCache(
+    ConfigClass.META_CACHE_SIZE,
+    ConfigClass.META_CACHE_TTL,
+    ConfigClass.META_CACHE_REDIS_TTL,
+    ConfigClass.META_CACHE_REDIS_ENABLED,
+)
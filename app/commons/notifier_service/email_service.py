@@ -12,8 +12,7 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import httpx
-
+from app.commons.http_clients import get_client
 from app.config import ConfigClass
 
 
@@ -33,6 +32,6 @@ class SrvEmail:
         if template:
             payload['template'] = template
             payload['template_kwargs'] = template_kwargs
-        async with httpx.AsyncClient() as client:
-            res = await client.post(url=url, json=payload)
+        client = get_client('email')
+        res = await client.post(url=url, json=payload)
         return res.json()
@@ -0,0 +1,112 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import base64
+import binascii
+import json
+from datetime import datetime
+from typing import Any
+
+from fastapi_sqlalchemy import db
+from sqlalchemy import and_, false, func, or_
+from sqlalchemy.orm import InstrumentedAttribute, Query
+
+from app.models.base import EAPIResponseCode, ECountMode, PaginationRequest
+from app.resources.error_handler import APIException
+
+# A sort key is a column and whether it's sorted descending
+SortKey = tuple[InstrumentedAttribute, bool]
+
+
+def encode_cursor(values: list[Any]) -> str:
+    values = [value.isoformat() if isinstance(value, datetime) else value for value in values]
+    return base64.urlsafe_b64encode(json.dumps(values, default=str).encode()).decode()
+
+
+def decode_cursor(cursor: str, size: int) -> list[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, ValueError):
+        values = None
+    if not isinstance(values, list) or len(values) != size:
+        raise APIException(EAPIResponseCode.bad_request.value, f'Invalid cursor: {cursor}')
+    return values
+
+
+def _after(column: InstrumentedAttribute, descending: bool, value: Any):
+    # Postgres sorts nulls last in ascending and first in descending order
+    if value is None:
+        return column.isnot(None) if descending else false()
+    if descending:
+        return column < value
+    return or_(column > value, column.is_(None))
+
+
+def _equal(column: InstrumentedAttribute, value: Any):
+    return column.is_(None) if value is None else column == value
+
+
+def keyset_filter(sort_keys: list[SortKey], values: list[Any]):
+    """Match the rows sorted after the row with the given values, sort keys may mix directions and hold nulls."""
+    clauses = []
+    for i, (column, descending) in enumerate(sort_keys):
+        ties = [_equal(tie_column, value) for (tie_column, _), value in zip(sort_keys[:i], values[:i])]
+        clauses.append(and_(*ties, _after(column, descending, values[i])))
+    return or_(*clauses)
+
+
+def estimate_count(query: Query) -> int:
+    """Return the number of rows the planner expects the query to return, without running it."""
+    statement = query.order_by(None).statement
+    compiled = statement.compile(dialect=db.session.bind.dialect, compile_kwargs={'render_postcompile': True})
+    plan = db.session.connection().exec_driver_sql('EXPLAIN (FORMAT JSON) ' + str(compiled), compiled.params).scalar()
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+def paginate(query: Query, sort_keys: list[SortKey], params: PaginationRequest) -> tuple[list, str, int]:
+    """Return one page of the query, the cursor of the next page (None on the last page) and the total.
+
+    Pages are seeked from params.cursor when it's given and fall back to page offsets otherwise.
+    The last sort key has to be unique so every row has a distinct position.
+
+    The total depends on params.count_mode: exact runs a separate count, estimate asks the planner and
+    window adds a count over the page query itself. The window count is refused with a cursor, it would
+    only cover the rows from the cursor on. A page past the end has no rows to carry it, it falls back to exact.
+    """
+    if params.cursor and params.count_mode == ECountMode.window:
+        raise APIException(EAPIResponseCode.bad_request.value, 'The window count mode can\'t be used with a cursor')
+    total = None
+    count_query = query.order_by(None)
+    if params.count_mode == ECountMode.exact:
+        total = count_query.count()
+    elif params.count_mode == ECountMode.estimate:
+        total = estimate_count(query)
+    else:
+        query = query.add_columns(func.count().over().label('total'))
+
+    query = query.order_by(*(column.desc() if descending else column.asc() for column, descending in sort_keys))
+    if params.cursor:
+        query = query.filter(keyset_filter(sort_keys, decode_cursor(params.cursor, len(sort_keys))))
+    else:
+        query = query.offset(params.page * params.page_size)
+    # One extra row tells whether there is a next page
+    results = query.limit(params.page_size + 1).all()
+    if params.count_mode == ECountMode.window:
+        total = results[0].total if results else count_query.count()
+        results = [row[0] for row in results]
+    next_cursor = None
+    if len(results) > params.page_size:
+        results = results[:params.page_size]
+        next_cursor = encode_cursor([getattr(results[-1], column.key) for column, _ in sort_keys])
+    return results, next_cursor, total
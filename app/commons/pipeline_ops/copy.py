@@ -12,9 +12,9 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import httpx
 from common import LoggerFactory
 
+from app.commons.http_clients import get_client
 from app.config import ConfigClass
 from app.models.base import EAPIResponseCode
 from app.resources.error_handler import APIException
@@ -45,11 +45,11 @@ async def trigger_copy_pipeline(
         'project_code': project_code,
         'session_id': session_id,
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            ConfigClass.DATA_UTILITY_SERVICE + 'files/actions/',
-            json=copy_data,
-            headers=auth)
+    client = get_client('dataops')
+    response = await client.post(
+        ConfigClass.DATA_UTILITY_SERVICE + 'files/actions/',
+        json=copy_data,
+        headers=auth)
     if response.status_code >= 300:
         error_msg = f'Failed to start copy pipeline: {response.content}'
         logger.error(error_msg)
@@ -12,103 +12,458 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-from datetime import datetime
+from datetime import datetime, timedelta
+from uuid import UUID, uuid4
 
 from fastapi_sqlalchemy import db
+from sqlalchemy import and_, func, literal, or_, select
+from sqlalchemy.dialects.postgresql import array, insert
+from sqlalchemy.orm import aliased
 
-from app.models.copy_request_sql import EntityModel
+from app.commons.pagination import paginate
+from app.config import ConfigClass
+from app.models.base import ECountMode, PaginationRequest
+from app.models.copy_request_sql import (
+    REVIEW_STATUSES,
+    EntityModel,
+    IngestionCheckpointModel,
+    RequestModel,
+    RequestSummaryModel,
+)
 
 
-def get_sql_files_recursive(request_id: str, folder_id: str, file_ids: list[str] = None) -> list[EntityModel]:
-    if not file_ids:
-        file_ids = []
+def request_project_code(request_id: str):
+    return select(RequestModel.project_code).where(RequestModel.id == request_id).scalar_subquery()
 
-    entities = db.session.query(EntityModel).filter_by(request_id=request_id, parent_id=folder_id)
-    for entity in entities:
-        if entity.entity_type == 'file':
-            if entity.review_status == 'pending':
-                file_ids.append(entity.entity_id)
-        else:
-            file_ids = get_sql_files_recursive(request_id, entity.entity_id, file_ids=file_ids)
-    return file_ids
 
+def in_request(request_id: str, entities=EntityModel):
+    """Match the entities of a request, the project code lets Postgres skip the partitions of other projects.
+
+    entities is the entity model, an alias of it or the columns of an entity table.
+    """
+    return and_(entities.request_id == request_id, entities.project_code == request_project_code(request_id))
 
-def get_all_sub_files(request_id: str, entity_ids: list[str]) -> list[str]:
-    entities = db.session.query(EntityModel).filter_by(request_id=request_id).filter(
-        EntityModel.entity_id.in_(entity_ids)
-    )
-    file_ids = []
-    for entity in entities:
-        if entity.entity_type == 'file':
-            file_ids.append(entity.entity_id)
-        else:
-            # Get all files in subfolder
-            file_ids = get_sql_files_recursive(request_id, entity.entity_id, file_ids=file_ids)
-    return file_ids
-
-
-def get_sql_file_nodes_recursive(
-    request_id: str,
-    folder_id: str,
-    review_status: str,
-    files: list = None
-) -> list[EntityModel]:
-    if not files:
-        files = []
-
-    entities = db.session.query(EntityModel).filter_by(request_id=request_id, parent_id=folder_id)
-    for entity in entities:
-        if entity.entity_type == 'file':
-            if entity.review_status == review_status:
-                files.append(entity.entity_id)
-        else:
-            files = get_sql_file_nodes_recursive(request_id, entity.entity_id, review_status, files=files)
-    return files
 
+def count_files_by_status(request_id: str, entity_ids: list[str] = None) -> dict[str, int]:
+    """Count the files of a request per review status in one aggregation.
 
-def get_all_sub_folder_nodes(request_id: str, entity_ids: list[str], review_status: str) -> list[str]:
-    entities = db.session.query(EntityModel).filter_by(request_id=request_id).filter(
-        EntityModel.entity_id.in_(entity_ids)
+    With entity_ids only the files within the nested set range of the selected folders are counted.
+    """
+    query = db.session.query(EntityModel.review_status, func.count(EntityModel.id)).filter(
+        in_request(request_id),
+        EntityModel.entity_type == 'file',
     )
-    files = []
-    for entity in entities:
-        if entity.entity_type == 'folder':
-            # Get all files in subfolder
-            files = get_sql_file_nodes_recursive(request_id, entity.entity_id, review_status, files=files)
-    return files
+    if entity_ids is not None:
+        folders = aliased(EntityModel)
+        query = query.join(folders, and_(
+            in_request(request_id, folders),
+            folders.entity_id.in_(entity_ids),
+            folders.entity_type == 'folder',
+            EntityModel.lft > folders.lft,
+            EntityModel.lft <= folders.rgt,
+        ))
+    return dict(query.group_by(EntityModel.review_status).all())
 
 
-def update_files_sql(request_id: str, review_status: str, username: str, file_ids: list[str]) -> int:
-    review_data = {
-        'review_status': review_status,
-        'reviewed_by': username,
-        'reviewed_at': datetime.utcnow(),
-    }
-    files = db.session.query(EntityModel).filter_by(request_id=request_id).filter(
-        EntityModel.entity_id.in_(file_ids)
-    )
-    files.update(review_data)
-    db.session.commit()
-    return files.count()
+def get_ancestors(request_id: str, entity_id: str) -> list[EntityModel]:
+    """Return an entity followed by its ancestors up to the top level, every row whose range contains it."""
+    node_lft = select(EntityModel.lft).where(
+        in_request(request_id),
+        EntityModel.entity_id == entity_id,
+    ).order_by(EntityModel.lft).limit(1).scalar_subquery()
+    return db.session.query(EntityModel).filter(
+        in_request(request_id),
+        EntityModel.lft <= node_lft,
+        EntityModel.rgt >= node_lft,
+    ).order_by(EntityModel.lft.desc()).all()
+
+
+def update_files_sql(request_id: str, review_status: str, username: str, entity_ids: list[str] = None) -> int:
+    """Review files of a request in a single statement and return the number of updated files.
 
+    Without entity_ids every pending file is reviewed, otherwise the selected files and the pending files
+    within the nested set range of every selected folder. The review counters of the folders above the
+    updated files are adjusted by the same statement.
+    """
+    conditions = [in_request(request_id), EntityModel.entity_type == 'file']
+    if entity_ids is None:
+        conditions.append(EntityModel.review_status == 'pending')
+    else:
+        folders = aliased(EntityModel)
+        in_selected_folder = select(folders.id).where(
+            in_request(request_id, folders),
+            folders.entity_id.in_(entity_ids),
+            folders.entity_type != 'file',
+            EntityModel.lft > folders.lft,
+            EntityModel.lft <= folders.rgt,
+        ).exists()
+        conditions.append(or_(
+            EntityModel.entity_id.in_(entity_ids),
+            and_(EntityModel.review_status == 'pending', in_selected_folder),
+        ))
+    # Files are locked while reading their previous status so the counter deltas can't go stale
+    previous = select(EntityModel.id, EntityModel.review_status).where(*conditions).with_for_update()
+    previous = previous.subquery('previous')
+    table = EntityModel.__table__
+    changed = table.update().where(in_request(request_id, table.c), table.c.id == previous.c.id).values(
+        review_status=review_status,
+        reviewed_by=username,
+        reviewed_at=datetime.utcnow(),
+    ).returning(table.c.lft, previous.c.review_status.label('previous_status')).cte('changed')
 
-def create_entity_from_node(request_id: str, entity: dict) -> EntityModel:
-    # Create entity in psql given meta
+    folders = table.alias('folders')
+    deltas = select(
+        folders.c.id,
+        func.count().label('total'),
+        *(func.count().filter(changed.c.previous_status == status).label(status) for status in REVIEW_STATUSES),
+    ).select_from(
+        folders.join(changed, and_(changed.c.lft > folders.c.lft, changed.c.lft <= folders.c.rgt))
+    ).where(
+        in_request(request_id, folders.c),
+        folders.c.entity_type == 'folder',
+    ).group_by(folders.c.id).cte('deltas')
+    counters = {}
+    for status in REVIEW_STATUSES:
+        counter = table.c[f'{status}_count'] - deltas.c[status]
+        counters[f'{status}_count'] = counter + deltas.c.total if status == review_status else counter
+    folder_counters = table.update().where(in_request(request_id, table.c), table.c.id == deltas.c.id)
+    folder_counters = folder_counters.values(**counters).cte('folder_counters')
 
-    entity_data = {
+    request_delta = select(
+        func.count().label('total'),
+        *(func.count().filter(changed.c.previous_status == status).label(status) for status in REVIEW_STATUSES),
+    ).select_from(changed).cte('request_delta')
+    summary = RequestSummaryModel.__table__
+    counters = {}
+    for status in REVIEW_STATUSES:
+        counter = summary.c[f'{status}_count'] - request_delta.c[status]
+        counters[f'{status}_count'] = counter + request_delta.c.total if status == review_status else counter
+    summary_counters = summary.update().where(
+        summary.c.request_id == request_id,
+        request_delta.c.total > 0,
+    ).values(**counters)
+    summary_counters = summary_counters.cte('summary_counters')
+
+    updated = db.session.execute(
+        select(request_delta.c.total).add_cte(folder_counters).add_cte(summary_counters)
+    ).scalar()
+    db.session.commit()
+    return updated
+
+
+def entity_data_from_node(request_id: str, project_code: str, entity: dict) -> dict:
+    # Map a meta node to an approval_entity row, every row carries the same keys so they can be batched
+    is_file = entity['type'] == 'file'
+    return {
+        'id': uuid4(),
+        'project_code': project_code,
         'request_id': request_id,
         'entity_id': entity['id'],
         'entity_type': entity['type'],
         'parent_id': entity['parent'],
         'name': entity['name'],
         'uploaded_by': entity['owner'],
-        'uploaded_at': entity['created_time']
+        'uploaded_at': entity['created_time'],
+        'review_status': 'pending' if is_file else None,
+        'file_size': entity['size'] if is_file else None,
+        'copy_status': 'pending' if is_file else None,
+        'archived': entity.get('archived', False),
     }
-    if entity['type'] == 'file':
-        entity_data['review_status'] = 'pending'
-        entity_data['file_size'] = entity['size']
-        entity_data['copy_status'] = 'pending'
-    entity_obj = EntityModel(**entity_data)
-    db.session.add(entity_obj)
+
+
+def bulk_create_entities(request_id: str, entities: list[dict], batch_size: int = None) -> int:
+    """Insert entity rows in batches of executemany statements without committing."""
+    if not batch_size:
+        batch_size = ConfigClass.ENTITY_INSERT_BATCH_SIZE
+
+    # Rows are routed to the partition of their project
+    project_code = db.session.query(RequestModel.project_code).filter_by(id=request_id).scalar()
+    table = EntityModel.__table__
+    for i in range(0, len(entities), batch_size):
+        rows = [entity_data_from_node(request_id, project_code, entity) for entity in entities[i:i + batch_size]]
+        db.session.execute(table.insert(), rows)
+    return len(entities)
+
+
+def count_entities(request_id: str) -> tuple[int, int]:
+    count, size = db.session.query(
+        func.count(EntityModel.id),
+        func.coalesce(func.sum(EntityModel.file_size), 0),
+    ).filter(in_request(request_id)).one()
+    return count, size
+
+
+def claim_ingestion(request_id: str, queued: bool = False) -> bool:
+    """Take over ingestion of a request unless another run has touched it within INGESTION_STALE_TIMEOUT.
+
+    A queued claim leaves the heartbeat empty so the worker picking up the job can claim it in turn.
+    """
+    stale_at = datetime.utcnow() - timedelta(seconds=ConfigClass.INGESTION_STALE_TIMEOUT)
+    claimed = db.session.query(RequestModel).filter(
+        RequestModel.id == request_id,
+        RequestModel.status.in_(['ingesting', 'failed']),
+        or_(RequestModel.ingestion_updated_at.is_(None), RequestModel.ingestion_updated_at < stale_at),
+    ).update(
+        {'status': 'ingesting', 'ingestion_updated_at': None if queued else datetime.utcnow()},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    return bool(claimed)
+
+
+def count_folder_files(request_id: str) -> int:
+    """Fill the review counters and byte total of each folder from the files in its range, without committing."""
+    table = EntityModel.__table__
+    folders = table.alias('folders')
+    files = table.alias('files')
+    totals = select(
+        folders.c.id,
+        func.coalesce(func.sum(files.c.file_size), 0).label('total_size'),
+        *(func.count(files.c.id).filter(files.c.review_status == status).label(status) for status in REVIEW_STATUSES),
+    ).select_from(
+        folders.outerjoin(files, and_(
+            in_request(request_id, files.c),
+            files.c.entity_type == 'file',
+            files.c.lft > folders.c.lft,
+            files.c.lft <= folders.c.rgt,
+        ))
+    ).where(
+        in_request(request_id, folders.c),
+        folders.c.entity_type == 'folder',
+    ).group_by(folders.c.id).subquery('totals')
+    counters = {f'{status}_count': totals.c[status] for status in REVIEW_STATUSES}
+    result = db.session.execute(
+        table.update().where(in_request(request_id, table.c), table.c.id == totals.c.id).values(
+            total_size=totals.c.total_size, **counters
+        )
+    )
+    return result.rowcount
+
+
+def summarize_request(request_id: str):
+    """Write the file counters of a request to its summary row, without committing."""
+    totals = select(
+        literal(request_id).label('request_id'),
+        func.count().label('file_count'),
+        func.coalesce(func.sum(EntityModel.file_size), 0).label('total_size'),
+        *(
+            func.count().filter(EntityModel.review_status == status).label(f'{status}_count')
+            for status in REVIEW_STATUSES
+        ),
+    ).where(in_request(request_id), EntityModel.entity_type == 'file')
+    columns = ['request_id', 'file_count', 'total_size', *(f'{status}_count' for status in REVIEW_STATUSES)]
+    statement = insert(RequestSummaryModel.__table__).from_select(columns, totals)
+    # A retried ingestion recounts everything instead of adding to an earlier summary
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['request_id'],
+        set_={column: statement.excluded[column] for column in columns[1:]},
+    ))
+
+
+def get_pending_entities(
+    request_id: str, page_size: int, cursor: str = None, count_mode: ECountMode = ECountMode.exact
+) -> tuple[list[str], str, int]:
+    """Return a page of the pending files of a request that aren't archived, the next cursor and their count.
+
+    Rows are seeked by primary key so a page costs the same wherever it starts in a large request.
+    """
+    query = db.session.query(EntityModel.id, EntityModel.entity_id).filter(
+        in_request(request_id),
+        EntityModel.review_status == 'pending',
+        EntityModel.archived.isnot(True),
+    )
+    params = PaginationRequest(page_size=page_size, cursor=cursor, count_mode=count_mode)
+    rows, next_cursor, total = paginate(query, [(EntityModel.id, False)], params)
+    return [str(row.entity_id) for row in rows], next_cursor, total
+
+
+def set_archived(request_id: str, entity_ids: list[str]) -> int:
+    if not entity_ids:
+        return 0
+    return db.session.query(EntityModel).filter(
+        in_request(request_id),
+        EntityModel.entity_id.in_(entity_ids),
+    ).update({'archived': True}, synchronize_session=False)
+
+
+def get_stale_archive_requests(limit: int) -> list[RequestModel]:
+    checked_before = datetime.utcnow() - timedelta(seconds=ConfigClass.ARCHIVE_FRESHNESS)
+    return db.session.query(RequestModel).filter(
+        RequestModel.status == 'pending',
+        or_(RequestModel.archive_checked_at.is_(None), RequestModel.archive_checked_at < checked_before),
+    ).order_by(RequestModel.archive_checked_at.asc().nullsfirst()).limit(limit).all()
+
+
+def get_request_summary(request_id: str) -> RequestSummaryModel:
+    return db.session.query(RequestSummaryModel).get(request_id)
+
+
+def get_live_request(request_id: str) -> RequestModel:
+    """Return a request unless it doesn't exist or is marked for deletion."""
+    return db.session.query(RequestModel).filter(
+        RequestModel.id == request_id, RequestModel.status != 'deleting'
+    ).first()
+
+
+def number_entities(request_id: str) -> int:
+    """Assign nested set numbers to every entity of a request in one statement, without committing.
+
+    lft is the pre-order position of an entity and rgt the position of its last descendant,
+    so the subtree of an entity is every row of the request with lft between its lft and rgt.
+    Entities whose parent is not part of the request are numbered as roots.
+    """
+    parents = aliased(EntityModel)
+    has_parent = select(parents.id).where(
+        in_request(request_id, parents),
+        parents.entity_id == EntityModel.parent_id,
+    ).exists()
+    tree = select(
+        EntityModel.id,
+        EntityModel.entity_id,
+        literal(0).label('depth'),
+        array([EntityModel.id]).label('path'),
+    ).where(in_request(request_id), ~has_parent).cte('entity_tree', recursive=True)
+    children = aliased(EntityModel)
+    tree = tree.union_all(
+        select(
+            children.id,
+            children.entity_id,
+            tree.c.depth + 1,
+            tree.c.path.op('||')(children.id),
+        ).where(in_request(request_id, children), children.parent_id == tree.c.entity_id)
+    )
+    # Ordering by the path of ids gives a pre-order walk, every ancestor sorts right before its subtree
+    numbered = select(
+        tree.c.id,
+        tree.c.depth,
+        func.row_number().over(order_by=tree.c.path).label('lft'),
+    ).cte('numbered')
+    ancestor = func.unnest(tree.c.path).table_valued('id').lateral('ancestor').render_derived()
+    sizes = select(ancestor.c.id, func.count().label('size')).select_from(
+        tree.join(ancestor, literal(True))
+    ).group_by(ancestor.c.id).cte('sizes')
+    result = db.session.execute(
+        EntityModel.__table__.update().where(
+            in_request(request_id),
+            EntityModel.id == numbered.c.id,
+            EntityModel.id == sizes.c.id,
+        ).values(
+            lft=numbered.c.lft,
+            rgt=numbered.c.lft + sizes.c.size - 1,
+            depth=numbered.c.depth,
+        )
+    )
+    return result.rowcount
+
+
+def touch_ingestion(request_id: str):
+    db.session.query(RequestModel).filter_by(id=request_id).update(
+        {'ingestion_updated_at': datetime.utcnow()}, synchronize_session=False
+    )
+
+
+def ingestion_running(request_id: str) -> bool:
+    """Tell whether an ingestion run has touched the request within INGESTION_STALE_TIMEOUT."""
+    stale_at = datetime.utcnow() - timedelta(seconds=ConfigClass.INGESTION_STALE_TIMEOUT)
+    query = db.session.query(RequestModel.id).filter(
+        RequestModel.id == request_id,
+        RequestModel.status == 'ingesting',
+        RequestModel.ingestion_updated_at >= stale_at,
+    )
+    return query.first() is not None
+
+
+def finish_ingestion(request_id: str) -> bool:
+    """Make an ingested request available for review, unless it was marked for deletion meanwhile."""
+    # Archived flags were just taken from the metadata service
+    finished = db.session.query(RequestModel).filter(
+        RequestModel.id == request_id, RequestModel.status == 'ingesting'
+    ).update({'status': 'pending', 'archive_checked_at': datetime.utcnow()}, synchronize_session=False)
+    db.session.commit()
+    return bool(finished)
+
+
+def fail_ingestion(request_id: str):
+    # A request marked for deletion stays so, the worker still has to purge it
+    db.session.query(RequestModel).filter(
+        RequestModel.id == request_id, RequestModel.status != 'deleting'
+    ).update({'status': 'failed', 'ingestion_updated_at': None}, synchronize_session=False)
     db.session.commit()
-    return entity_obj
+
+
+def get_checkpoints(request_id: str) -> dict[UUID, IngestionCheckpointModel]:
+    checkpoints = db.session.query(IngestionCheckpointModel).filter_by(request_id=request_id)
+    return {checkpoint.entity_id: checkpoint for checkpoint in checkpoints}
+
+
+def create_top_level_entities(request_id: str, entities: list[dict]) -> dict[UUID, IngestionCheckpointModel]:
+    # The selected entities and a checkpoint for each of them are committed together
+    bulk_create_entities(request_id, entities)
+    checkpoints = {}
+    for entity in entities:
+        checkpoint = IngestionCheckpointModel(
+            request_id=request_id, entity_id=entity['id'], next_page=0, completed=False
+        )
+        db.session.add(checkpoint)
+        checkpoints[UUID(entity['id'])] = checkpoint
+    touch_ingestion(request_id)
+    db.session.commit()
+    return checkpoints
+
+
+def save_page(request_id: str, checkpoint: IngestionCheckpointModel, entities: list[dict], next_page: int):
+    # Rows and checkpoint are committed together so a resumed ingestion never inserts a page twice
+    bulk_create_entities(request_id, entities)
+    checkpoint.next_page = next_page
+    touch_ingestion(request_id)
+    db.session.commit()
+
+
+def complete_checkpoint(request_id: str, checkpoint: IngestionCheckpointModel):
+    checkpoint.completed = True
+    touch_ingestion(request_id)
+    db.session.commit()
+
+
+def exceeds_entity_count(request_id: str, limit: int) -> bool:
+    """Tell whether a request has more than limit entities without counting all of them."""
+    query = db.session.query(EntityModel.id).filter(in_request(request_id))
+    return query.offset(limit).limit(1).first() is not None
+
+
+def delete_request_rows(request_id: str) -> int:
+    """Delete a request in one statement, its entities, summary and checkpoints go with it by cascade."""
+    deleted = db.session.query(RequestModel).filter_by(id=request_id).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+
+def mark_deleting(request_id: str) -> int:
+    """Hide a request from its listings until the worker purges it."""
+    marked = db.session.query(RequestModel).filter_by(id=request_id).update(
+        {'status': 'deleting'}, synchronize_session=False
+    )
+    db.session.commit()
+    return marked
+
+
+def purge_entities(request_id: str, batch_size: int) -> int:
+    """Delete up to batch_size entities of a request in a short transaction of its own."""
+    batch = (
+        select(EntityModel.id).where(in_request(request_id)).limit(batch_size).scalar_subquery()
+    )
+    result = db.session.execute(
+        EntityModel.__table__.delete().where(in_request(request_id), EntityModel.id.in_(batch))
+    )
+    db.session.commit()
+    return result.rowcount
+
+
+def purge_deleted_requests(limit: int = 1) -> int:
+    """Purge requests marked for deletion, their entities go in PURGE_BATCH_SIZE chunks before the request row."""
+    requests = db.session.query(RequestModel.id).filter_by(status='deleting').limit(limit).all()
+    for request_id, in requests:
+        while purge_entities(request_id, ConfigClass.PURGE_BATCH_SIZE) == ConfigClass.PURGE_BATCH_SIZE:
+            pass
+        delete_request_rows(request_id)
+    return len(requests)
@@ -0,0 +1,64 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from datetime import datetime, timedelta
+
+from common import LoggerFactory
+from fastapi_sqlalchemy import db
+
+from app.commons.meta_services import bulk_get_by_ids
+from app.commons.psql_services import (
+    get_pending_entities,
+    get_stale_archive_requests,
+    set_archived,
+)
+from app.config import ConfigClass
+from app.models.base import ECountMode
+from app.models.copy_request_sql import RequestModel
+
+logger = LoggerFactory('reconciliation').get_logger()
+
+
+async def reconcile_archived(request_obj: RequestModel) -> int:
+    """Flag the pending files of a request that were archived in the metadata service since they were checked."""
+    checked = archived = 0
+    chunk_size = ConfigClass.META_BATCH_SIZE * ConfigClass.META_SERVICE_CONCURRENCY
+    cursor = None
+    while True:
+        # Rows flagged as archived are behind the cursor already, so they don't shift the next chunk
+        pending_ids, cursor, _ = get_pending_entities(request_obj.id, chunk_size, cursor, ECountMode.estimate)
+        nodes = await bulk_get_by_ids(pending_ids, use_cache=False) if pending_ids else []
+        archived += set_archived(request_obj.id, [node['id'] for node in nodes if node.get('archived')])
+        checked += len(pending_ids)
+        if not cursor:
+            break
+    request_obj.archive_checked_at = datetime.utcnow()
+    db.session.commit()
+    logger.info(f'Reconciled {checked} pending files of request {request_obj.id}, {archived} archived')
+    return archived
+
+
+async def ensure_archive_fresh(request_obj: RequestModel):
+    """Reconcile archived flags of a request unless they were checked within ARCHIVE_FRESHNESS."""
+    checked_before = datetime.utcnow() - timedelta(seconds=ConfigClass.ARCHIVE_FRESHNESS)
+    if request_obj.archive_checked_at is None or request_obj.archive_checked_at < checked_before:
+        await reconcile_archived(request_obj)
+
+
+async def reconcile_stale_requests(limit: int = 10) -> int:
+    """Reconcile the pending requests whose archived flags are the most out of date."""
+    requests = get_stale_archive_requests(limit)
+    for request_obj in requests:
+        await reconcile_archived(request_obj)
+    return len(requests)
@@ -65,6 +65,44 @@ class Settings(BaseSettings):
 
     EMAIL_SUPPORT: str = 'jzhang@indocresearch.org'
 
+    HTTP2_ENABLED: bool = False
+    HTTP_KEEPALIVE_EXPIRY: float = 30
+    AUTH_MAX_CONNECTIONS: int = 20
+    AUTH_TIMEOUT: float = 10
+    DATAOPS_MAX_CONNECTIONS: int = 10
+    DATAOPS_TIMEOUT: float = 30
+    EMAIL_MAX_CONNECTIONS: int = 10
+    EMAIL_CONCURRENCY: int = 5
+    EMAIL_TIMEOUT: float = 10
+    METADATA_MAX_CONNECTIONS: int = 50
+    METADATA_TIMEOUT: float = 30
+
+    META_SERVICE_CONCURRENCY: int = 10
+    # Seconds the archived flags of a request stay trusted before they're reconciled with the metadata service
+    ARCHIVE_FRESHNESS: int = 300
+    ARCHIVE_RECONCILE_INTERVAL: int = 60
+    META_SEARCH_PAGE_SIZE: int = 1000
+    META_BATCH_SIZE: int = 500
+    META_CACHE_SIZE: int = 10000
+    META_CACHE_TTL: int = 60
+    META_CACHE_REDIS_ENABLED: bool = True
+    META_CACHE_REDIS_TTL: int = 300
+
+    ENTITY_INSERT_BATCH_SIZE: int = 1000
+    # Most pending file ids listed in one response, the count always covers all of them
+    PENDING_PAGE_SIZE: int = 1000
+    # Requests with more entities are deleted in the background, PURGE_BATCH_SIZE rows per transaction
+    DELETE_INLINE_LIMIT: int = 10000
+    PURGE_BATCH_SIZE: int = 5000
+    # Entities of requests completed this long ago are moved to the compressed archive table
+    COLD_ARCHIVE_AFTER_DAYS: int = 90
+    COLD_ARCHIVE_INTERVAL: int = 60 * 60
+    COLD_ARCHIVE_BATCH_SIZE: int = 10
+
+    INGESTION_POLL_TIMEOUT: int = 5
+    INGESTION_STALE_TIMEOUT: int = 10 * 60
+    INGESTION_PROGRESS_TTL: int = 7 * 24 * 60 * 60
+
     def __init__(self, *args: Any, **kwds: Any) -> None:
         super().__init__(*args, **kwds)
 
@@ -17,7 +17,9 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 from fastapi_sqlalchemy import DBSessionMiddleware
 
+from app.commons.http_clients import close_clients, open_clients
 from app.resources.error_handler import APIException
+from app.routers.v1.api_copy_request.request_notify import drain_notifications
 
 from .api_registry import api_registry
 from .config import ConfigClass
@@ -42,6 +44,16 @@ def create_app():
     # v1
     api_registry(app)
 
+    @app.on_event('startup')
+    async def startup():
+        open_clients()
+
+    @app.on_event('shutdown')
+    async def shutdown():
+        # Notifications still being sent need the http clients
+        await drain_notifications()
+        await close_clients()
+
     @app.exception_handler(APIException)
     async def http_exception_handler(request: Request, exc: APIException):
         return JSONResponse(
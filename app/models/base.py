@@ -20,6 +20,7 @@ from pydantic import BaseModel
 
 class EAPIResponseCode(Enum):
     success = 200
+    accepted = 202
     internal_error = 500
     bad_request = 400
     not_found = 404
@@ -28,6 +29,12 @@ class EAPIResponseCode(Enum):
     conflict = 409
 
 
+class ECountMode(str, Enum):
+    exact = 'exact'
+    window = 'window'
+    estimate = 'estimate'
+
+
 class APIResponse(BaseModel):
     code: EAPIResponseCode = EAPIResponseCode.success
     error_msg: str = ''
@@ -42,8 +49,15 @@ class APIResponse(BaseModel):
         return JSONResponse(status_code=self.code.value, content=data)
 
 
+class PaginatedResponse(APIResponse):
+    next_cursor: str = None
+
+
 class PaginationRequest(BaseModel):
     page: int = 0
     page_size: int = 25
     order_type: str = 'asc'
     order_by: str = 'uploaded_at'
+    # Opaque cursor from next_cursor of the previous page, page is ignored when it's set
+    cursor: str = None
+    count_mode: ECountMode = ECountMode.exact
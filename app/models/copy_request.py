@@ -28,6 +28,7 @@ class POSTRequest(BaseModel):
     source_id: str
     note: str
     submitted_by: str
+    ingest_async: bool = False
 
     @validator('note')
     def valid_note(cls, value):
@@ -47,6 +48,25 @@ class POSTRequestResponse(APIResponse):
     })
 
 
+class GETIngestionResponse(APIResponse):
+    result: dict = Field({}, example={
+        'code': 200,
+        'error_msg': '',
+        'num_of_pages': 1,
+        'page': 0,
+        'result': {
+            'request_id': 'uuid',
+            'status': 'ingesting',
+            'files_total': 1000,
+            'files_ingested': 250,
+            'bytes_ingested': 1024,
+            'eta_seconds': 30,
+            'error': '',
+        },
+        'total': 1
+    })
+
+
 class GETRequest(PaginationRequest):
     status: str
     submitted_by: str = None
@@ -143,6 +163,9 @@ class PUTRequestFilesResponse(APIResponse):
 
 class GETRequestPending(BaseModel):
     request_id: uuid.UUID
+    # Capped at PENDING_PAGE_SIZE, defaults to it when not given
+    page_size: int = Field(None, gt=0)
+    cursor: str = None
 
 
 class GETPendingResponse(APIResponse):
@@ -155,5 +178,6 @@ class GETPendingResponse(APIResponse):
             'pending_count': 1,
             'pending_entities': ['geid'],
         },
-        'total': 1
+        'total': 1,
+        'next_cursor': None,
     })
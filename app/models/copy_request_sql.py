@@ -15,7 +15,21 @@
 from datetime import datetime
 from uuid import uuid4
 
-from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, String
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    LargeBinary,
+    String,
+    UniqueConstraint,
+    event,
+    text,
+)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -23,10 +37,33 @@ from app.config import ConfigClass
 
 Base = declarative_base()
 
+REVIEW_STATUSES = ('pending', 'approved', 'denied')
+
+# approval_entity is hash partitioned by project code, changing the count needs a migration that repartitions it
+ENTITY_PARTITIONS = 8
+
 
 class RequestModel(Base):
     __tablename__ = 'approval_request'
-    __table_args__ = {'schema': ConfigClass.RDS_SCHEMA_DEFAULT}
+    __table_args__ = (
+        UniqueConstraint('project_code', 'idempotency_key'),
+        Index('approval_request_project_code_status_submitted_at_idx', 'project_code', 'status', 'submitted_at'),
+        Index(
+            'approval_request_project_code_submitted_by_status_idx',
+            'project_code',
+            'submitted_by',
+            'status',
+            'submitted_at',
+        ),
+        # completed requests waiting for the cold archiver
+        Index(
+            'approval_request_status_completed_at_idx',
+            'status',
+            'completed_at',
+            postgresql_where=text('cold_archived_at IS NULL'),
+        ),
+        {'schema': ConfigClass.RDS_SCHEMA_DEFAULT},
+    )
     id = Column(UUID(as_uuid=True), unique=True, primary_key=True, default=uuid4)
     status = Column(String())
     submitted_by = Column(String())
@@ -40,11 +77,26 @@ class RequestModel(Base):
     review_notes = Column(String())
     completed_by = Column(String())
     completed_at = Column(DateTime())
+    idempotency_key = Column(String(), nullable=True)
+    ingestion_updated_at = Column(DateTime(), nullable=True)
+    archive_checked_at = Column(DateTime(), nullable=True)
+    # Set while the entities of a completed request are kept compressed in approval_request_archive
+    cold_archived_at = Column(DateTime(), nullable=True)
+    # Last time the entities were restored from the archive, the request stays out of the archive for a while
+    rehydrated_at = Column(DateTime(), nullable=True)
 
     def to_dict(self):
         result = {}
         for field in self.__table__.columns.keys():
-            if field in ['submitted_at', 'completed_at']:
+            dates = [
+                'submitted_at',
+                'completed_at',
+                'ingestion_updated_at',
+                'archive_checked_at',
+                'cold_archived_at',
+                'rehydrated_at',
+            ]
+            if field in dates:
                 if getattr(self, field):
                     result[field] = str(getattr(self, field).isoformat()[:-3] + 'Z')
                 else:
@@ -58,9 +110,17 @@ class RequestModel(Base):
 
 class EntityModel(Base):
     __tablename__ = 'approval_entity'
-    __table_args__ = {'schema': ConfigClass.RDS_SCHEMA_DEFAULT}
-    id = Column(UUID(as_uuid=True), unique=True, primary_key=True, default=uuid4)
-    request_id = Column(UUID(as_uuid=True), ForeignKey(RequestModel.id))
+    __table_args__ = (
+        Index('approval_entity_request_id_lft_idx', 'request_id', 'lft'),
+        Index('approval_entity_request_id_parent_id_idx', 'request_id', 'parent_id'),
+        Index('approval_entity_request_id_entity_id_idx', 'request_id', 'entity_id'),
+        Index('approval_entity_request_id_review_status_idx', 'request_id', 'review_status'),
+        {'schema': ConfigClass.RDS_SCHEMA_DEFAULT, 'postgresql_partition_by': 'HASH (project_code)'},
+    )
+    # The partition key has to be part of the primary key
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid4)
+    project_code = Column(String(), primary_key=True)
+    request_id = Column(UUID(as_uuid=True), ForeignKey(RequestModel.id, ondelete='CASCADE'))
     entity_id = Column(UUID(as_uuid=True))
     entity_type = Column(String())
     review_status = Column(String())
@@ -72,6 +132,15 @@ class EntityModel(Base):
     uploaded_by = Column(String(), nullable=True)
     uploaded_at = Column(DateTime(), default=datetime.utcnow)
     file_size = Column(BigInteger(), nullable=True)
+    archived = Column(Boolean(), default=False)
+    lft = Column(Integer(), nullable=True)
+    rgt = Column(Integer(), nullable=True)
+    depth = Column(Integer(), nullable=True)
+    # Counters over the files below a folder, kept up to date by every review update
+    pending_count = Column(Integer(), nullable=True)
+    approved_count = Column(Integer(), nullable=True)
+    denied_count = Column(Integer(), nullable=True)
+    total_size = Column(BigInteger(), nullable=True)
 
     def to_dict(self):
         result = {}
@@ -83,3 +152,53 @@ class EntityModel(Base):
             else:
                 result[field] = getattr(self, field)
         return result
+
+
+for remainder in range(ENTITY_PARTITIONS):
+    event.listen(
+        EntityModel.__table__,
+        'after_create',
+        DDL(
+            f'CREATE TABLE %(schema)s.approval_entity_p{remainder} PARTITION OF %(fullname)s '
+            f'FOR VALUES WITH (MODULUS {ENTITY_PARTITIONS}, REMAINDER {remainder})'
+        ),
+    )
+
+
+class RequestSummaryModel(Base):
+    __tablename__ = 'approval_request_summary'
+    __table_args__ = {'schema': ConfigClass.RDS_SCHEMA_DEFAULT}
+    request_id = Column(UUID(as_uuid=True), ForeignKey(RequestModel.id, ondelete='CASCADE'), primary_key=True)
+    file_count = Column(Integer(), default=0)
+    total_size = Column(BigInteger(), default=0)
+    pending_count = Column(Integer(), default=0)
+    approved_count = Column(Integer(), default=0)
+    denied_count = Column(Integer(), default=0)
+
+    def to_dict(self):
+        result = {}
+        for field in self.__table__.columns.keys():
+            if field == 'request_id':
+                result[field] = str(getattr(self, field))
+            else:
+                result[field] = getattr(self, field)
+        return result
+
+
+class IngestionCheckpointModel(Base):
+    __tablename__ = 'approval_ingestion_checkpoint'
+    __table_args__ = {'schema': ConfigClass.RDS_SCHEMA_DEFAULT}
+    request_id = Column(UUID(as_uuid=True), ForeignKey(RequestModel.id, ondelete='CASCADE'), primary_key=True)
+    entity_id = Column(UUID(as_uuid=True), primary_key=True)
+    next_page = Column(Integer(), default=0)
+    completed = Column(Boolean(), default=False)
+
+
+class RequestArchiveModel(Base):
+    __tablename__ = 'approval_request_archive'
+    __table_args__ = {'schema': ConfigClass.RDS_SCHEMA_DEFAULT}
+    request_id = Column(UUID(as_uuid=True), ForeignKey(RequestModel.id, ondelete='CASCADE'), primary_key=True)
+    entity_count = Column(Integer(), default=0)
+    # zlib compressed JSON list of the entity rows of the request
+    entities = Column(LargeBinary())
+    archived_at = Column(DateTime(), default=datetime.utcnow)
@@ -12,28 +12,42 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
 import math
 from datetime import datetime
+from typing import Optional
 
 from common import LoggerFactory
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Header, Request
 from fastapi_sqlalchemy import db
 from fastapi_utils import cbv
+from sqlalchemy.exc import IntegrityError
 
-from app.commons.meta_services import (
-    bulk_get_by_ids,
-    get_files_recursive,
-    get_node_by_id,
-)
+from app.commons.cold_archive import rehydrate_request
+from app.commons.ingestion import ingest_request
+from app.commons.ingestion.jobs import enqueue_ingestion, get_progress
+from app.commons.meta_services import bulk_get_by_ids, get_node_by_id
+from app.commons.pagination import paginate
 from app.commons.pipeline_ops.copy import trigger_copy_pipeline
 from app.commons.psql_services import (
-    create_entity_from_node,
-    get_all_sub_files,
-    get_all_sub_folder_nodes,
+    claim_ingestion,
+    count_files_by_status,
+    delete_request_rows,
+    exceeds_entity_count,
+    get_ancestors,
+    get_live_request,
+    get_pending_entities,
+    get_request_summary,
+    in_request,
+    ingestion_running,
+    mark_deleting,
     update_files_sql,
 )
-from app.models.base import APIResponse, EAPIResponseCode
+from app.commons.reconciliation import ensure_archive_fresh
+from app.config import ConfigClass
+from app.models.base import APIResponse, EAPIResponseCode, PaginatedResponse
 from app.models.copy_request import (
+    GETIngestionResponse,
     GETPendingResponse,
     GETRequest,
     GETRequestFiles,
@@ -49,7 +63,7 @@ from app.models.copy_request import (
 )
 from app.models.copy_request_sql import EntityModel, RequestModel
 
-from .request_notify import notify_project_admins, notify_user
+from .request_notify import notify_project_admins, notify_user, schedule_notification
 
 logger = LoggerFactory('api_copy_request').get_logger()
 
@@ -58,6 +72,98 @@ _API_TAG = 'CopyRequest'
 _API_NAMESPACE = 'copy_request'
 
 
+def node_path(node: dict) -> str:
+    return node['parent_path'] + '.' + node['name'] if node['parent_path'] else node['name']
+
+
+def claim_idempotent_request(
+    project_code: str, idempotency_key: str, ingest_async: bool
+) -> tuple[Optional[RequestModel], Optional[APIResponse]]:
+    """Find the request of an earlier submission with the same key and take over its ingestion.
+
+    Returns the request to ingest again, or a response when there's nothing left to ingest or another run still
+    owns the ingestion.
+    """
+    if not idempotency_key:
+        return None, None
+    request_obj = db.session.query(RequestModel).filter_by(
+        project_code=project_code,
+        idempotency_key=idempotency_key,
+    ).first()
+    if not request_obj:
+        return None, None
+
+    api_response = APIResponse()
+    api_response.result = request_obj.to_dict()
+    if request_obj.status not in ['ingesting', 'failed']:
+        # Already ingested by an earlier submission with the same key
+        return request_obj, api_response
+    if not claim_ingestion(request_obj.id, queued=ingest_async):
+        if ingest_async:
+            api_response.code = EAPIResponseCode.accepted
+        else:
+            api_response.code = EAPIResponseCode.conflict
+            api_response.error_msg = f'Request {request_obj.id} is already being ingested'
+            api_response.result = []
+        return request_obj, api_response
+    return request_obj, None
+
+
+def find_reviewable_request(request_id: str) -> tuple[Optional[RequestModel], Optional[APIResponse]]:
+    """Find a request whose files can be reviewed, or the response to send when there's none.
+
+    A request still being ingested, or whose ingestion failed, isn't complete yet and can't be reviewed.
+    """
+    api_response = APIResponse()
+    request_obj = get_live_request(request_id)
+    if not request_obj:
+        api_response.code = EAPIResponseCode.not_found
+        api_response.error_msg = 'Request not found'
+        return None, api_response
+    if request_obj.status in ['ingesting', 'failed']:
+        api_response.code = EAPIResponseCode.conflict
+        api_response.error_msg = f'Request {request_obj.id} is {request_obj.status}, its files are not all ingested'
+        return None, api_response
+    return request_obj, None
+
+
+async def create_request_row(
+    project_code: str, data: POSTRequest, idempotency_key: str
+) -> tuple[RequestModel, Optional[list[dict]]]:
+    """Create a request in the ingesting state, with the selected entities unless they're left to the worker."""
+    entities = None
+    if data.ingest_async:
+        # Selected entities are fetched by the ingestion worker
+        dest_folder_node, source_folder_node = await asyncio.gather(
+            get_node_by_id(data.destination_id),
+            get_node_by_id(data.source_id),
+        )
+    else:
+        dest_folder_node, source_folder_node, entities = await asyncio.gather(
+            get_node_by_id(data.destination_id),
+            get_node_by_id(data.source_id),
+            bulk_get_by_ids(data.entity_ids),
+        )
+    request_data = {
+        'status': 'ingesting',
+        'submitted_by': data.submitted_by,
+        'destination_id': data.destination_id,
+        'source_id': data.source_id,
+        'note': data.note,
+        'project_code': project_code,
+        'destination_path': node_path(dest_folder_node),
+        'source_path': node_path(source_folder_node),
+        'idempotency_key': idempotency_key,
+        # Queued requests are claimed by the worker that picks up the job
+        'ingestion_updated_at': None if data.ingest_async else datetime.utcnow(),
+    }
+    request_obj = RequestModel(**request_data)
+    db.session.add(request_obj)
+    db.session.commit()
+    db.session.refresh(request_obj)
+    return request_obj, entities
+
+
 @cbv.cbv(router)
 class APICopyRequest:
 
@@ -67,50 +173,70 @@ class APICopyRequest:
         response_model=POSTRequestResponse,
         summary='Create a copy request'
     )
-    async def create_request(self, project_code: str, data: POSTRequest):
+    async def create_request(
+        self,
+        project_code: str,
+        data: POSTRequest,
+        idempotency_key: str = Header(None),
+    ):
         logger.info('Create Request called')
         api_response = APIResponse()
 
-        dest_folder_node = get_node_by_id(data.destination_id)
-        source_folder_node = get_node_by_id(data.source_id)
-        if dest_folder_node["parent_path"]:
-            dest_path = dest_folder_node['parent_path'] + '.' + dest_folder_node['name']
+        request_obj, claim_response = claim_idempotent_request(project_code, idempotency_key, data.ingest_async)
+        if claim_response:
+            return claim_response.json_response()
+        if request_obj:
+            logger.info(f'Resuming ingestion of request {request_obj.id}')
+            entities = None if data.ingest_async else await bulk_get_by_ids(data.entity_ids)
         else:
-            dest_path = dest_folder_node['name']
-        if source_folder_node["parent_path"]:
-            source_path = source_folder_node['parent_path'] + '.' + source_folder_node['name']
-        else:
-            source_path = source_folder_node['name']
-        request_data = {
-            'status': 'pending',
-            'submitted_by': data.submitted_by,
-            'destination_id': data.destination_id,
-            'source_id': data.source_id,
-            'note': data.note,
-            'project_code': project_code,
-            'destination_path': dest_path,
-            'source_path': source_path,
-        }
-        request_obj = RequestModel(**request_data)
-        db.session.add(request_obj)
-        db.session.commit()
-        db.session.refresh(request_obj)
+            try:
+                request_obj, entities = await create_request_row(project_code, data, idempotency_key)
+            except IntegrityError:
+                db.session.rollback()
+                api_response.code = EAPIResponseCode.conflict
+                api_response.error_msg = f'Request with idempotency key {idempotency_key} already exists'
+                return api_response.json_response()
 
-        all_files = []
-        entities = bulk_get_by_ids(data.entity_ids)
-        for entity in entities:
-            entity['parent'] = None
-            all_files.append(entity)
-            all_files = all_files + get_files_recursive(entity)
+        if data.ingest_async:
+            await enqueue_ingestion(request_obj.id, data.entity_ids)
+            logger.info(f'Queued ingestion of request {request_obj.id}')
+            api_response.code = EAPIResponseCode.accepted
+            api_response.result = request_obj.to_dict()
+            return api_response.json_response()
 
-        for entity in all_files:
-            create_entity_from_node(request_obj.id, entity)
+        await ingest_request(request_obj, entities)
 
         submitted_at = request_obj.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
-        await notify_project_admins(data.submitted_by, project_code, submitted_at)
+        # Admins are notified on a task of its own, the response doesn't wait for the emails
+        schedule_notification(notify_project_admins, request_obj.submitted_by, project_code, submitted_at)
         api_response.result = request_obj.to_dict()
         return api_response.json_response()
 
+    @router.get(
+        '/request/copy/{project_code}/ingestion/{request_id}',
+        tags=[_API_TAG],
+        response_model=GETIngestionResponse,
+        summary='Get ingestion progress of a copy request'
+    )
+    async def get_ingestion(self, project_code: str, request_id: str):
+        logger.info('Get ingestion called')
+        api_response = APIResponse()
+        request_obj = db.session.query(RequestModel).filter_by(id=request_id, project_code=project_code).first()
+        if not request_obj:
+            api_response.code = EAPIResponseCode.not_found
+            api_response.error_msg = 'Request not found'
+            return api_response.json_response()
+
+        progress = await get_progress(request_id)
+        if request_obj.status != 'ingesting':
+            progress['eta_seconds'] = 0 if not progress['error'] else None
+        api_response.result = {
+            'request_id': str(request_obj.id),
+            'status': request_obj.status,
+            **progress,
+        }
+        return api_response.json_response()
+
     @router.get(
         '/request/copy/{project_code}',
         tags=[_API_TAG],
@@ -119,27 +245,15 @@ class APICopyRequest:
     )
     def list_requests(self, project_code: str, params: GETRequest = Depends(GETRequest)):
         logger.info('List Requests called')
-        api_response = APIResponse()
+        api_response = PaginatedResponse()
         results = db.session.query(RequestModel).filter_by(
             status=params.status,
             project_code=project_code,
         )
         if params.submitted_by:
             results = results.filter_by(submitted_by=params.submitted_by)
-        results = results.order_by(RequestModel.submitted_at.desc()).limit(params.page_size)
-        results = results.offset(params.page * params.page_size)
-
-        if params.submitted_by:
-            total = db.session.query(RequestModel).filter_by(
-                status=params.status,
-                project_code=project_code,
-                submitted_by=params.submitted_by
-            ).count()
-        else:
-            total = db.session.query(RequestModel).filter_by(
-                status=params.status,
-                project_code=project_code,
-            ).count()
+        sort_keys = [(RequestModel.submitted_at, True), (RequestModel.id, True)]
+        results, api_response.next_cursor, total = paginate(results, sort_keys, params)
         api_response.result = [i.to_dict() for i in results]
         api_response.total = total
         api_response.page = params.page
@@ -154,7 +268,14 @@ class APICopyRequest:
     )
     def list_request_files(self, project_code: str, params: GETRequestFiles = Depends(GETRequestFiles)):
         logger.info('List request files called')
-        api_response = APIResponse()
+        api_response = PaginatedResponse()
+        request_obj = get_live_request(params.request_id)
+        if not request_obj:
+            api_response.code = EAPIResponseCode.not_found
+            api_response.error_msg = 'Request not found'
+            return api_response.json_response()
+        # Entities of old completed requests are only kept in the archive until they're read again
+        rehydrate_request(request_obj)
         query_params = {
             'request_id': params.request_id
         }
@@ -163,35 +284,24 @@ class APICopyRequest:
         else:
             query_params['parent_id'] = None
 
-        sql_query = db.session.query(EntityModel)
+        sql_query = db.session.query(EntityModel).filter(in_request(params.request_id))
         for key, value in params.query.items():
             if key in params.partial:
                 sql_query = sql_query.filter(getattr(EntityModel, key).contains(value))
             else:
                 query_params[key] = value
 
-        if params.order_type == 'desc':
-            order_by = getattr(EntityModel, params.order_by).desc()
-        else:
-            order_by = getattr(EntityModel, params.order_by).asc()
-        sql_query = sql_query.filter_by(**query_params).order_by(EntityModel.entity_type.desc(), order_by)
-
-        results = sql_query.limit(params.page_size).offset(params.page * params.page_size)
+        sort_keys = [
+            (EntityModel.entity_type, True),
+            (getattr(EntityModel, params.order_by), params.order_type == 'desc'),
+            (EntityModel.id, False),
+        ]
+        sql_query = sql_query.filter_by(**query_params)
+        results, api_response.next_cursor, total = paginate(sql_query, sort_keys, params)
         routing = []
         if params.parent_id:
-            entity_id = params.parent_id
-            while entity_id:
-                file = db.session.query(EntityModel).filter_by(
-                    request_id=params.request_id,
-                    entity_id=entity_id
-                ).first()
-                if file:
-                    routing.append(file.to_dict())
-                    entity_id = file.parent_id
-                else:
-                    entity_id = None
-
-        total = db.session.query(EntityModel).filter_by(**query_params).count()
+            routing = [entity.to_dict() for entity in get_ancestors(params.request_id, params.parent_id)]
+
         api_response.result = {'data': [i.to_dict() for i in results], 'routing': routing}
         api_response.total = total
         api_response.page = params.page
@@ -207,23 +317,28 @@ class APICopyRequest:
     async def review_all_files(self, project_code: str, data: PUTRequestFiles, request: Request):
         logger.info('Review all files called')
         api_response = APIResponse()
+        request_obj, error_response = find_reviewable_request(data.request_id)
+        if error_response:
+            return error_response.json_response()
+        rehydrate_request(request_obj)
         review_status = data.review_status
 
-        approved = db.session.query(EntityModel).filter_by(request_id=data.request_id, review_status='approved')
-        denied = db.session.query(EntityModel).filter_by(request_id=data.request_id, review_status='denied')
-        skipped_data = {'approved': approved.count(), 'denied': denied.count()}
+        summary = get_request_summary(data.request_id)
+        skipped_data = {
+            'approved': summary.approved_count if summary else 0,
+            'denied': summary.denied_count if summary else 0,
+        }
 
-        entities = db.session.query(EntityModel).filter_by(request_id=data.request_id, review_status='pending')
-        file_ids = [i.entity_id for i in entities]
-        result = update_files_sql(data.request_id, review_status, data.username, file_ids)
+        result = update_files_sql(data.request_id, review_status, data.username)
 
         if review_status == 'approved':
-            top_level_entities = db.session.query(EntityModel).filter_by(request_id=data.request_id, parent_id=None)
+            top_level_entities = db.session.query(EntityModel).filter(
+                in_request(data.request_id), EntityModel.parent_id.is_(None)
+            )
             top_level_ids = [i.entity_id for i in top_level_entities]
             if top_level_ids:
                 # Send top level file/folder ids to copy pipeline
                 logger.info(f'Triggering pipeline for {top_level_ids}')
-                request_obj: RequestModel = db.session.query(RequestModel).get(data.request_id)
                 auth = {
                     'Authorization': request.headers.get('Authorization').replace('Bearer ', ''),
                     'Refresh-Token': request.headers.get('Refresh-Token'),
@@ -254,19 +369,20 @@ class APICopyRequest:
         logger.info('Review files called')
         api_response = APIResponse()
         review_status = data.review_status
+        request_obj, error_response = find_reviewable_request(data.request_id)
+        if error_response:
+            return error_response.json_response()
+        rehydrate_request(request_obj)
 
-        approved = get_all_sub_folder_nodes(data.request_id, data.entity_ids, 'approved')
-        denied = get_all_sub_folder_nodes(data.request_id, data.entity_ids, 'denied')
-        skipped_data = {'approved': len(approved), 'denied': len(denied)}
+        counts = count_files_by_status(data.request_id, data.entity_ids)
+        skipped_data = {'approved': counts.get('approved', 0), 'denied': counts.get('denied', 0)}
 
-        file_ids = get_all_sub_files(data.request_id, data.entity_ids)
-        result = update_files_sql(data.request_id, review_status, data.username, file_ids)
+        result = update_files_sql(data.request_id, review_status, data.username, data.entity_ids)
 
         if review_status == 'approved':
             if data.entity_ids:
                 # Send id's of file/folders submitted by frontend to copy pipeline
                 logger.info(f'Triggering pipeline for {data.entity_ids}')
-                request_obj: RequestModel = db.session.query(RequestModel).get(data.request_id)
                 auth = {
                     'Authorization': request.headers.get('Authorization').replace('Bearer ', ''),
                 }
@@ -295,28 +411,24 @@ class APICopyRequest:
         logger.info('Complete request called')
         api_response = APIResponse()
 
-        request_obj = db.session.query(RequestModel).get(data.request_id)
-
-        query_params = {
-            'request_id': data.request_id,
-            'review_status': 'pending',
-        }
-        pending_files = db.session.query(EntityModel).filter_by(**query_params)
-        if pending_files.count():
-            pending_entities = [str(i.entity_id) for i in pending_files]
-            # exclude delted files from pending list
-            pending_nodes = bulk_get_by_ids(pending_entities)
-            for entity in pending_nodes:
-                if entity['archived']:
-                    pending_entities.remove(entity['global_entity_id'])
-            if pending_entities:
-                error_msg = f'{len(pending_entities)} pending files in request'
+        request_obj, error_response = find_reviewable_request(data.request_id)
+        if error_response:
+            return error_response.json_response()
+
+        summary = get_request_summary(data.request_id)
+        if summary is None or summary.pending_count:
+            # archived files don't need a review, their flags are refreshed when they're out of date
+            await ensure_archive_fresh(request_obj)
+            pending_entities, _, pending_count = get_pending_entities(data.request_id, ConfigClass.PENDING_PAGE_SIZE)
+            if pending_count:
+                error_msg = f'{pending_count} pending files in request'
                 logger.info(error_msg)
                 api_response.error_msg = error_msg
+                # Only the first page of ids is returned, the rest can be listed from pending-files
                 api_response.result = {
                     'status': 'pending',
                     'pending_entities': pending_entities,
-                    'pending_count': len(pending_entities),
+                    'pending_count': pending_count,
                 }
                 api_response.code = EAPIResponseCode.bad_request
                 return api_response.json_response()
@@ -330,12 +442,13 @@ class APICopyRequest:
 
         submitted_at = request_obj.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
         completed_at = request_obj.completed_at.strftime('%Y-%m-%d %H:%M:%S')
-        await notify_user(
+        schedule_notification(
+            notify_user,
             request_obj.submitted_by,
             data.username,
             project_code,
             submitted_at,
-            completed_at
+            completed_at,
         )
         api_response.result = {
             'status': data.status,
@@ -350,31 +463,32 @@ class APICopyRequest:
         response_model=GETPendingResponse,
         summary='Get pending count'
     )
-    def get_pending(
+    async def get_pending(
         self,
         project_code: str,
         params: GETRequestPending = Depends(GETRequestPending)
     ):
         logger.info('Get Pending called')
-        api_response = APIResponse()
-
-        query_params = {
-            'request_id': params.request_id,
-            'review_status': 'pending',
-        }
-        pending_files = db.session.query(EntityModel).filter_by(**query_params)
-        logger.info(f'{pending_files.count()} pending files in request')
-        pending_entities = [str(i.entity_id) for i in pending_files]
-        if pending_entities:
-            # exclude deleted files from pending list
-            pending_nodes = bulk_get_by_ids(pending_entities)
-            for entity in pending_nodes:
-                if entity['archived']:
-                    pending_entities.remove(entity['global_entity_id'])
+        api_response = PaginatedResponse()
+        page_size = min(params.page_size or ConfigClass.PENDING_PAGE_SIZE, ConfigClass.PENDING_PAGE_SIZE)
+
+        # The summary answers requests without pending files, rows are only loaded to list them
+        summary = get_request_summary(params.request_id)
+        pending_entities, pending_count = [], 0
+        if summary is None or summary.pending_count:
+            request_obj = db.session.query(RequestModel).get(params.request_id)
+            if request_obj:
+                await ensure_archive_fresh(request_obj)
+            pending_entities, api_response.next_cursor, pending_count = get_pending_entities(
+                params.request_id, page_size, params.cursor
+            )
+        logger.info(f'{pending_count} pending files in request')
         api_response.result = {
             'pending_entities': pending_entities,
-            'pending_count': len(pending_entities),
+            'pending_count': pending_count,
         }
+        api_response.total = pending_count
+        api_response.num_of_pages = math.ceil(pending_count / page_size)
         return api_response.json_response()
 
     @router.delete(
@@ -384,14 +498,16 @@ class APICopyRequest:
     )
     def delete_request(self, project_code: str, request_id: str):
         api_response = APIResponse()
-        request_files = db.session.query(
-            EntityModel).filter_by(request_id=request_id)
-        for request_file in request_files:
-            db.session.delete(request_file)
-        db.session.commit()
-
-        request_obj = db.session.query(RequestModel).get(request_id)
-        db.session.delete(request_obj)
-        db.session.commit()
+        if ingestion_running(request_id):
+            # A running ingestion keeps writing the rows the delete would remove
+            api_response.code = EAPIResponseCode.conflict
+            api_response.error_msg = f'Request {request_id} is being ingested'
+            return api_response.json_response()
+        if exceeds_entity_count(request_id, ConfigClass.DELETE_INLINE_LIMIT):
+            # Large requests are hidden right away and purged in chunks by the worker
+            mark_deleting(request_id)
+            logger.info(f'Request {request_id} marked for deletion')
+        else:
+            delete_request_rows(request_id)
         api_response.result = 'success'
         return api_response.json_response()
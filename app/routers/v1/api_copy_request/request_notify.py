@@ -12,44 +12,83 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-import httpx
+import asyncio
+from typing import Awaitable, Callable
+
+from common import LoggerFactory
+
+from app.commons.concurrency import gather_with_concurrency
+from app.commons.http_clients import get_client
 from app.commons.project_services import query_project
 from app.commons.notifier_service.email_service import SrvEmail
 from app.config import ConfigClass
 
+logger = LoggerFactory('request_notify').get_logger()
+
+# Running notifications are referenced until they finish, the event loop only keeps weak references to tasks
+_notification_tasks: set[asyncio.Task] = set()
+
 
 async def get_user(username: str) -> dict:
     query = {
         'username': username,
         'exact': True,
     }
-    async with httpx.AsyncClient() as client:
-        response = await client.get(ConfigClass.AUTH_SERVICE + 'admin/user', params=query)
+    client = get_client('auth')
+    response = await client.get(ConfigClass.AUTH_SERVICE + 'admin/user', params=query)
     if response.status_code != 200:
         raise Exception(f'Error getting user {username} from auth service: ' + str(response.json()))
     return response.json()['result']
 
 
+async def get_project_admins(project_code: str) -> list:
+    payload = {
+        'role_names': [f'{project_code}-admin'],
+        'status': 'active',
+    }
+    client = get_client('auth')
+    response = await client.post(
+        ConfigClass.AUTH_SERVICE + 'admin/roles/users',
+        json=payload
+    )
+    return response.json()['result']
+
+
+async def dispatch_notification(notify: Callable[..., Awaitable], *args) -> None:
+    """Run a notification outside the request path, failures are logged since nobody awaits them."""
+    try:
+        await notify(*args)
+    except Exception:
+        logger.exception(f'Error sending notification {notify.__name__}')
+
+
+def schedule_notification(notify: Callable[..., Awaitable], *args) -> asyncio.Task:
+    """Send a notification on its own task so the response doesn't wait for it."""
+    task = asyncio.create_task(dispatch_notification(notify, *args))
+    _notification_tasks.add(task)
+    task.add_done_callback(_notification_tasks.discard)
+    return task
+
+
+async def drain_notifications():
+    """Wait for the notifications still being sent, on shutdown."""
+    await asyncio.gather(*_notification_tasks)
+
+
 async def notify_project_admins(
     username: str,
     project_code: str,
     request_timestamp: str
 ):
-    user_node = await get_user(username)
-    project = await query_project(project_code)
-    payload = {
-        'role_names': [f'{project_code}-admin'],
-        'status': 'active',
-    }
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            ConfigClass.AUTH_SERVICE + 'admin/roles/users',
-            json=payload
-        )
-    project_admins = response.json()['result']
+    user_node, project, project_admins = await asyncio.gather(
+        get_user(username),
+        query_project(project_code),
+        get_project_admins(project_code),
+    )
+    email_service = SrvEmail()
+    sends = []
     for project_admin in project_admins:
-        email_service = SrvEmail()
-        await email_service.send(
+        sends.append(email_service.send(
             'A new request to copy data to Core needs your approval',
             project_admin['email'],
             ConfigClass.EMAIL_SUPPORT,
@@ -62,13 +101,16 @@ async def notify_project_admins(
                 'project_name': project.name,
                 'request_timestamp': request_timestamp,
             },
-        )
+        ))
+    await gather_with_concurrency(ConfigClass.EMAIL_CONCURRENCY, *sends)
 
 
 async def notify_user(username: str, admin_username: str, project_code: str, request_timestamp: str, complete_timestamp: str):
-    user_node = await get_user(username)
-    admin_node = await get_user(admin_username)
-    project = await query_project(project_code)
+    user_node, admin_node, project = await asyncio.gather(
+        get_user(username),
+        get_user(admin_username),
+        query_project(project_code),
+    )
     email_service = SrvEmail()
     await email_service.send(
         'Your request to copy data to Core is Completed',
@@ -5,6 +5,7 @@ from fastapi.responses import Response
 from fastapi_sqlalchemy import db
 from fastapi_utils import cbv
 
+from app.commons.meta_services.cache import node_cache
 from app.config import ConfigClass
 from app.models.copy_request_sql import RequestModel
 from app.resources.error_handler import APIException
@@ -48,3 +49,10 @@ class Health:
         await db_health_check()
         await redis_health_check()
         return Response(status_code=204)
+
+    @router.get(
+        '/health/cache/',
+        summary='Metadata node cache counters',
+    )
+    async def get_cache(self):
+        return node_cache.stats()
@@ -0,0 +1,147 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+import time
+from datetime import datetime, timedelta
+
+from common import LoggerFactory
+from fastapi_sqlalchemy import db
+
+from app.commons.cold_archive import archive_completed_requests
+from app.commons.http_clients import close_clients
+from app.commons.ingestion import ingest_request
+from app.commons.ingestion.jobs import (
+    IngestionProgress,
+    ack_ingestion,
+    dequeue_ingestion,
+    get_unacked_ingestions,
+    requeue_ingestion,
+)
+from app.commons.meta_services import bulk_get_by_ids
+from app.commons.psql_services import (
+    claim_ingestion,
+    fail_ingestion,
+    purge_deleted_requests,
+)
+from app.commons.reconciliation import reconcile_stale_requests
+from app.config import ConfigClass
+from app.models.copy_request_sql import RequestModel
+from app.routers.v1.api_copy_request.request_notify import (
+    drain_notifications,
+    notify_project_admins,
+    schedule_notification,
+)
+
+logger = LoggerFactory('ingestion_worker').get_logger()
+
+
+async def process_ingestion_job(job: dict):
+    """Ingest the entities of a request created in async mode and mark it pending for review."""
+    request_id = job['request_id']
+    with db():
+        if not claim_ingestion(request_id):
+            logger.warning(f'Skipping ingestion job for request {request_id}, it is not waiting for ingestion')
+            return
+        logger.info(f'Ingestion of request {request_id} started')
+        request_obj = db.session.query(RequestModel).get(request_id)
+
+        progress = IngestionProgress(request_id)
+        try:
+            entities = await bulk_get_by_ids(job['entity_ids'])
+            await ingest_request(request_obj, entities, progress)
+        except Exception as e:
+            logger.error(f'Ingestion job for request {request_id} failed: {e}')
+            db.session.rollback()
+            fail_ingestion(request_id)
+            await progress.save(error=str(e))
+            return
+
+        submitted_at = request_obj.submitted_at.strftime('%Y-%m-%d %H:%M:%S')
+        # The worker moves on to the next job while the emails are sent, a failed email doesn't fail the job
+        schedule_notification(notify_project_admins, request_obj.submitted_by, request_obj.project_code, submitted_at)
+    logger.info(f'Ingestion of request {request_id} finished')
+
+
+async def requeue_stale_ingestions():
+    """Queue jobs again whose worker stopped heartbeating before it acked them, drop the ones that are done."""
+    stale_at = datetime.utcnow() - timedelta(seconds=ConfigClass.INGESTION_STALE_TIMEOUT)
+    for item in await get_unacked_ingestions():
+        request_id = json.loads(item)['request_id']
+        with db():
+            request_obj = db.session.query(RequestModel).get(request_id)
+            if request_obj is None or request_obj.status != 'ingesting':
+                await ack_ingestion(item)
+            elif request_obj.ingestion_updated_at is None or request_obj.ingestion_updated_at < stale_at:
+                logger.warning(f'Requeueing ingestion job for request {request_id}, its worker stopped')
+                await requeue_ingestion(item)
+
+
+async def reconcile_archives():
+    with db():
+        try:
+            await reconcile_stale_requests()
+        except Exception:
+            db.session.rollback()
+            logger.exception('Error reconciling archived files')
+
+
+def purge_deleted():
+    with db():
+        try:
+            if purge_deleted_requests():
+                logger.info('Purged a request marked for deletion')
+        except Exception:
+            db.session.rollback()
+            logger.exception('Error purging deleted requests')
+
+
+def archive_completed():
+    with db():
+        try:
+            archived = archive_completed_requests(ConfigClass.COLD_ARCHIVE_BATCH_SIZE)
+            if archived:
+                logger.info(f'Archived {archived} completed requests')
+        except Exception:
+            db.session.rollback()
+            logger.exception('Error archiving completed requests')
+
+
+async def run_worker():
+    logger.info('Ingestion worker waiting for jobs')
+    last_reconciled = last_archived = 0
+    try:
+        while True:
+            # Maintenance runs between jobs, dequeue returns at least every INGESTION_POLL_TIMEOUT
+            if time.monotonic() - last_reconciled >= ConfigClass.ARCHIVE_RECONCILE_INTERVAL:
+                await reconcile_archives()
+                last_reconciled = time.monotonic()
+            purge_deleted()
+            await requeue_stale_ingestions()
+            if time.monotonic() - last_archived >= ConfigClass.COLD_ARCHIVE_INTERVAL:
+                archive_completed()
+                last_archived = time.monotonic()
+            item = await dequeue_ingestion()
+            if not item:
+                continue
+            try:
+                await process_ingestion_job(json.loads(item))
+            except Exception:
+                # Left unacked, the job is queued again once its heartbeat is stale
+                logger.exception(f'Unexpected error processing ingestion job {item}')
+            else:
+                await ack_ingestion(item)
+    finally:
+        await drain_notifications()
+        await close_clients()
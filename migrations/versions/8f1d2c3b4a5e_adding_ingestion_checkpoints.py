@@ -0,0 +1,47 @@
+"""Adding ingestion checkpoints
+
+Revision ID: 8f1d2c3b4a5e
+Revises: 396048c16b59
+Create Date: 2022-06-20 10:12:41.512384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = '8f1d2c3b4a5e'
+down_revision = '396048c16b59'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('approval_request', sa.Column('idempotency_key', sa.String(), nullable=True), schema='pilot_approval')
+    op.add_column(
+        'approval_request', sa.Column('ingestion_updated_at', sa.DateTime(), nullable=True), schema='pilot_approval'
+    )
+    op.create_unique_constraint(
+        'approval_request_project_code_idempotency_key_key',
+        'approval_request',
+        ['project_code', 'idempotency_key'],
+        schema='pilot_approval',
+    )
+    op.create_table('approval_ingestion_checkpoint',
+    sa.Column('request_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('entity_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('next_page', sa.Integer(), nullable=True),
+    sa.Column('completed', sa.Boolean(), nullable=True),
+    sa.ForeignKeyConstraint(['request_id'], ['pilot_approval.approval_request.id'], ),
+    sa.PrimaryKeyConstraint('request_id', 'entity_id'),
+    schema='pilot_approval'
+    )
+
+
+def downgrade():
+    op.drop_table('approval_ingestion_checkpoint', schema='pilot_approval')
+    op.drop_constraint(
+        'approval_request_project_code_idempotency_key_key', 'approval_request', schema='pilot_approval'
+    )
+    op.drop_column('approval_request', 'ingestion_updated_at', schema='pilot_approval')
+    op.drop_column('approval_request', 'idempotency_key', schema='pilot_approval')
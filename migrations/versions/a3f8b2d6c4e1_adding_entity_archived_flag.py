@@ -0,0 +1,32 @@
+"""Adding entity archived flag
+
+Revision ID: a3f8b2d6c4e1
+Revises: f7c3d9e1b5a4
+Create Date: 2022-07-25 13:37:20.581046
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'a3f8b2d6c4e1'
+down_revision = 'f7c3d9e1b5a4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'approval_entity',
+        sa.Column('archived', sa.Boolean(), server_default=sa.false(), nullable=True),
+        schema='pilot_approval',
+    )
+    # Left empty so existing requests are reconciled the first time they're checked
+    op.add_column(
+        'approval_request', sa.Column('archive_checked_at', sa.DateTime(), nullable=True), schema='pilot_approval'
+    )
+
+
+def downgrade():
+    op.drop_column('approval_request', 'archive_checked_at', schema='pilot_approval')
+    op.drop_column('approval_entity', 'archived', schema='pilot_approval')
@@ -0,0 +1,45 @@
+"""Cascading request deletes
+
+Revision ID: b6d4e2a8f3c7
+Revises: a3f8b2d6c4e1
+Create Date: 2022-07-28 10:12:44.918305
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'b6d4e2a8f3c7'
+down_revision = 'a3f8b2d6c4e1'
+branch_labels = None
+depends_on = None
+
+TABLES = ['approval_entity', 'approval_request_summary', 'approval_ingestion_checkpoint']
+
+
+def upgrade():
+    for table in TABLES:
+        op.drop_constraint(f'{table}_request_id_fkey', table, type_='foreignkey', schema='pilot_approval')
+        op.create_foreign_key(
+            f'{table}_request_id_fkey',
+            table,
+            'approval_request',
+            ['request_id'],
+            ['id'],
+            source_schema='pilot_approval',
+            referent_schema='pilot_approval',
+            ondelete='CASCADE',
+        )
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_constraint(f'{table}_request_id_fkey', table, type_='foreignkey', schema='pilot_approval')
+        op.create_foreign_key(
+            f'{table}_request_id_fkey',
+            table,
+            'approval_request',
+            ['request_id'],
+            ['id'],
+            source_schema='pilot_approval',
+            referent_schema='pilot_approval',
+        )
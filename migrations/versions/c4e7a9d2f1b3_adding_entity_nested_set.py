@@ -0,0 +1,61 @@
+"""Adding entity nested set numbers
+
+Revision ID: c4e7a9d2f1b3
+Revises: 8f1d2c3b4a5e
+Create Date: 2022-06-27 14:03:18.227915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'c4e7a9d2f1b3'
+down_revision = '8f1d2c3b4a5e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('approval_entity', sa.Column('lft', sa.Integer(), nullable=True), schema='pilot_approval')
+    op.add_column('approval_entity', sa.Column('rgt', sa.Integer(), nullable=True), schema='pilot_approval')
+    op.add_column('approval_entity', sa.Column('depth', sa.Integer(), nullable=True), schema='pilot_approval')
+    # Number the entities of existing requests the same way ingestion does, per request
+    op.execute(
+        '''
+        WITH RECURSIVE entity_tree(id, request_id, entity_id, depth, path) AS (
+            SELECT e.id, e.request_id, e.entity_id, 0, ARRAY[e.id]
+            FROM pilot_approval.approval_entity e
+            WHERE NOT EXISTS (
+                SELECT 1 FROM pilot_approval.approval_entity p
+                WHERE p.request_id = e.request_id AND p.entity_id = e.parent_id
+            )
+            UNION ALL
+            SELECT c.id, c.request_id, c.entity_id, t.depth + 1, t.path || c.id
+            FROM pilot_approval.approval_entity c
+            JOIN entity_tree t ON c.request_id = t.request_id AND c.parent_id = t.entity_id
+        ),
+        numbered AS (
+            SELECT id, depth, row_number() OVER (PARTITION BY request_id ORDER BY path) AS lft
+            FROM entity_tree
+        ),
+        sizes AS (
+            SELECT ancestor.id, count(*) AS size
+            FROM entity_tree, unnest(entity_tree.path) AS ancestor(id)
+            GROUP BY ancestor.id
+        )
+        UPDATE pilot_approval.approval_entity
+        SET lft = numbered.lft, rgt = numbered.lft + sizes.size - 1, depth = numbered.depth
+        FROM numbered JOIN sizes ON sizes.id = numbered.id
+        WHERE approval_entity.id = numbered.id
+        '''
+    )
+    op.create_index(
+        'approval_entity_request_id_lft_idx', 'approval_entity', ['request_id', 'lft'], schema='pilot_approval'
+    )
+
+
+def downgrade():
+    op.drop_index('approval_entity_request_id_lft_idx', table_name='approval_entity', schema='pilot_approval')
+    op.drop_column('approval_entity', 'depth', schema='pilot_approval')
+    op.drop_column('approval_entity', 'rgt', schema='pilot_approval')
+    op.drop_column('approval_entity', 'lft', schema='pilot_approval')
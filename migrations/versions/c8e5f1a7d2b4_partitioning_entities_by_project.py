@@ -0,0 +1,129 @@
+"""Partitioning entities by project
+
+Revision ID: c8e5f1a7d2b4
+Revises: b6d4e2a8f3c7
+Create Date: 2022-08-02 15:46:09.307512
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'c8e5f1a7d2b4'
+down_revision = 'b6d4e2a8f3c7'
+branch_labels = None
+depends_on = None
+
+PARTITIONS = 8
+COLUMNS = [
+    'id', 'request_id', 'entity_id', 'entity_type', 'review_status', 'reviewed_by', 'reviewed_at', 'parent_id',
+    'copy_status', 'name', 'uploaded_by', 'uploaded_at', 'file_size', 'archived', 'lft', 'rgt', 'depth',
+    'pending_count', 'approved_count', 'denied_count', 'total_size',
+]
+INDEXES = {
+    'approval_entity_request_id_lft_idx': ['request_id', 'lft'],
+    'approval_entity_request_id_parent_id_idx': ['request_id', 'parent_id'],
+    'approval_entity_request_id_entity_id_idx': ['request_id', 'entity_id'],
+    'approval_entity_request_id_review_status_idx': ['request_id', 'review_status'],
+}
+
+
+def create_entity_table(partitioned: bool):
+    op.create_table(
+        'approval_entity',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('project_code', sa.String(), nullable=not partitioned),
+        sa.Column('request_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('entity_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('entity_type', sa.String(), nullable=True),
+        sa.Column('review_status', sa.String(), nullable=True),
+        sa.Column('reviewed_by', sa.String(), nullable=True),
+        sa.Column('reviewed_at', sa.String(), nullable=True),
+        sa.Column('parent_id', postgresql.UUID(as_uuid=True), nullable=True),
+        sa.Column('copy_status', sa.String(), nullable=True),
+        sa.Column('name', sa.String(), nullable=True),
+        sa.Column('uploaded_by', sa.String(), nullable=True),
+        sa.Column('uploaded_at', sa.DateTime(), nullable=True),
+        sa.Column('file_size', sa.BigInteger(), nullable=True),
+        sa.Column('archived', sa.Boolean(), server_default=sa.false(), nullable=True),
+        sa.Column('lft', sa.Integer(), nullable=True),
+        sa.Column('rgt', sa.Integer(), nullable=True),
+        sa.Column('depth', sa.Integer(), nullable=True),
+        sa.Column('pending_count', sa.Integer(), nullable=True),
+        sa.Column('approved_count', sa.Integer(), nullable=True),
+        sa.Column('denied_count', sa.Integer(), nullable=True),
+        sa.Column('total_size', sa.BigInteger(), nullable=True),
+        schema='pilot_approval',
+        **({'postgresql_partition_by': 'HASH (project_code)'} if partitioned else {}),
+    )
+
+
+def create_entity_constraints(primary_key: list[str]):
+    op.create_primary_key('approval_entity_pkey', 'approval_entity', primary_key, schema='pilot_approval')
+    for name, columns in INDEXES.items():
+        op.create_index(name, 'approval_entity', columns, schema='pilot_approval')
+    op.create_foreign_key(
+        'approval_entity_request_id_fkey',
+        'approval_entity',
+        'approval_request',
+        ['request_id'],
+        ['id'],
+        source_schema='pilot_approval',
+        referent_schema='pilot_approval',
+        ondelete='CASCADE',
+    )
+
+
+def upgrade():
+    # Entities without a request or project code can't be routed to a partition, they'd be lost with the old table
+    orphans = op.get_bind().execute(
+        sa.text(
+            '''
+            SELECT count(*) FROM pilot_approval.approval_entity e
+            LEFT JOIN pilot_approval.approval_request r ON r.id = e.request_id
+            WHERE r.project_code IS NULL
+            '''
+        )
+    ).scalar()
+    if orphans:
+        raise RuntimeError(f'{orphans} entities have no request with a project code, remove them before partitioning')
+
+    # Rows are copied into a new partitioned table, constraints and indexes follow once the old one is gone
+    op.rename_table('approval_entity', 'approval_entity_unpartitioned', schema='pilot_approval')
+    create_entity_table(partitioned=True)
+    for remainder in range(PARTITIONS):
+        op.execute(
+            f'CREATE TABLE pilot_approval.approval_entity_p{remainder} PARTITION OF pilot_approval.approval_entity '
+            f'FOR VALUES WITH (MODULUS {PARTITIONS}, REMAINDER {remainder})'
+        )
+    columns = ', '.join(COLUMNS)
+    source_columns = ', '.join(f'e.{column}' for column in COLUMNS)
+    # Every entity has a project code through its request, it was checked above
+    op.execute(
+        f'''
+        INSERT INTO pilot_approval.approval_entity (project_code, {columns})
+        SELECT r.project_code, {source_columns}
+        FROM pilot_approval.approval_entity_unpartitioned e
+        JOIN pilot_approval.approval_request r ON r.id = e.request_id
+        WHERE r.project_code IS NOT NULL
+        '''
+    )
+    op.drop_table('approval_entity_unpartitioned', schema='pilot_approval')
+    create_entity_constraints(['id', 'project_code'])
+
+
+def downgrade():
+    op.rename_table('approval_entity', 'approval_entity_partitioned', schema='pilot_approval')
+    create_entity_table(partitioned=False)
+    columns = ', '.join(['project_code', *COLUMNS])
+    op.execute(
+        f'''
+        INSERT INTO pilot_approval.approval_entity ({columns})
+        SELECT {columns} FROM pilot_approval.approval_entity_partitioned
+        '''
+    )
+    op.drop_table('approval_entity_partitioned', schema='pilot_approval')
+    op.drop_column('approval_entity', 'project_code', schema='pilot_approval')
+    create_entity_constraints(['id'])
+    op.create_unique_constraint('approval_entity_id_key', 'approval_entity', ['id'], schema='pilot_approval')
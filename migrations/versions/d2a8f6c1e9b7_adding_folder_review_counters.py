@@ -0,0 +1,54 @@
+"""Adding folder review counters
+
+Revision ID: d2a8f6c1e9b7
+Revises: c4e7a9d2f1b3
+Create Date: 2022-07-04 11:26:52.904361
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'd2a8f6c1e9b7'
+down_revision = 'c4e7a9d2f1b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('approval_entity', sa.Column('pending_count', sa.Integer(), nullable=True), schema='pilot_approval')
+    op.add_column('approval_entity', sa.Column('approved_count', sa.Integer(), nullable=True), schema='pilot_approval')
+    op.add_column('approval_entity', sa.Column('denied_count', sa.Integer(), nullable=True), schema='pilot_approval')
+    op.add_column('approval_entity', sa.Column('total_size', sa.BigInteger(), nullable=True), schema='pilot_approval')
+    op.execute(
+        '''
+        UPDATE pilot_approval.approval_entity
+        SET pending_count = totals.pending,
+            approved_count = totals.approved,
+            denied_count = totals.denied,
+            total_size = totals.total_size
+        FROM (
+            SELECT folders.id,
+                count(files.id) FILTER (WHERE files.review_status = 'pending') AS pending,
+                count(files.id) FILTER (WHERE files.review_status = 'approved') AS approved,
+                count(files.id) FILTER (WHERE files.review_status = 'denied') AS denied,
+                coalesce(sum(files.file_size), 0) AS total_size
+            FROM pilot_approval.approval_entity folders
+            LEFT JOIN pilot_approval.approval_entity files
+                ON files.request_id = folders.request_id
+                AND files.entity_type = 'file'
+                AND files.lft > folders.lft
+                AND files.lft <= folders.rgt
+            WHERE folders.entity_type = 'folder'
+            GROUP BY folders.id
+        ) totals
+        WHERE approval_entity.id = totals.id
+        '''
+    )
+
+
+def downgrade():
+    op.drop_column('approval_entity', 'total_size', schema='pilot_approval')
+    op.drop_column('approval_entity', 'denied_count', schema='pilot_approval')
+    op.drop_column('approval_entity', 'approved_count', schema='pilot_approval')
+    op.drop_column('approval_entity', 'pending_count', schema='pilot_approval')
@@ -0,0 +1,45 @@
+"""Adding request cold archive
+
+Revision ID: d9f2a6b3e8c1
+Revises: c8e5f1a7d2b4
+Create Date: 2022-08-05 11:21:37.640215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'd9f2a6b3e8c1'
+down_revision = 'c8e5f1a7d2b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'approval_request', sa.Column('cold_archived_at', sa.DateTime(), nullable=True), schema='pilot_approval'
+    )
+    op.create_index(
+        'approval_request_status_completed_at_idx',
+        'approval_request',
+        ['status', 'completed_at'],
+        schema='pilot_approval',
+        postgresql_where=sa.text('cold_archived_at IS NULL'),
+    )
+    op.create_table(
+        'approval_request_archive',
+        sa.Column('request_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('entity_count', sa.Integer(), nullable=True),
+        sa.Column('entities', sa.LargeBinary(), nullable=True),
+        sa.Column('archived_at', sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(['request_id'], ['pilot_approval.approval_request.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('request_id'),
+        schema='pilot_approval',
+    )
+
+
+def downgrade():
+    op.drop_table('approval_request_archive', schema='pilot_approval')
+    op.drop_index('approval_request_status_completed_at_idx', table_name='approval_request', schema='pilot_approval')
+    op.drop_column('approval_request', 'cold_archived_at', schema='pilot_approval')
@@ -0,0 +1,25 @@
+"""Adding request rehydrated at
+
+Revision ID: e3b9d5a1c7f2
+Revises: d9f2a6b3e8c1
+Create Date: 2022-08-09 10:14:52.318604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'e3b9d5a1c7f2'
+down_revision = 'd9f2a6b3e8c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column(
+        'approval_request', sa.Column('rehydrated_at', sa.DateTime(), nullable=True), schema='pilot_approval'
+    )
+
+
+def downgrade():
+    op.drop_column('approval_request', 'rehydrated_at', schema='pilot_approval')
@@ -0,0 +1,51 @@
+"""Adding request summary
+
+Revision ID: e5b1c7f3a2d9
+Revises: d2a8f6c1e9b7
+Create Date: 2022-07-11 09:48:05.613290
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'e5b1c7f3a2d9'
+down_revision = 'd2a8f6c1e9b7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('approval_request_summary',
+    sa.Column('request_id', postgresql.UUID(as_uuid=True), nullable=False),
+    sa.Column('file_count', sa.Integer(), nullable=True),
+    sa.Column('total_size', sa.BigInteger(), nullable=True),
+    sa.Column('pending_count', sa.Integer(), nullable=True),
+    sa.Column('approved_count', sa.Integer(), nullable=True),
+    sa.Column('denied_count', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['request_id'], ['pilot_approval.approval_request.id'], ),
+    sa.PrimaryKeyConstraint('request_id'),
+    schema='pilot_approval'
+    )
+    op.execute(
+        '''
+        INSERT INTO pilot_approval.approval_request_summary
+            (request_id, file_count, total_size, pending_count, approved_count, denied_count)
+        SELECT approval_request.id,
+            count(files.id),
+            coalesce(sum(files.file_size), 0),
+            count(files.id) FILTER (WHERE files.review_status = 'pending'),
+            count(files.id) FILTER (WHERE files.review_status = 'approved'),
+            count(files.id) FILTER (WHERE files.review_status = 'denied')
+        FROM pilot_approval.approval_request
+        LEFT JOIN pilot_approval.approval_entity files
+            ON files.request_id = approval_request.id AND files.entity_type = 'file'
+        WHERE approval_request.status NOT IN ('ingesting', 'failed')
+        GROUP BY approval_request.id
+        '''
+    )
+
+
+def downgrade():
+    op.drop_table('approval_request_summary', schema='pilot_approval')
@@ -0,0 +1,65 @@
+"""Adding access pattern indexes
+
+Revision ID: f7c3d9e1b5a4
+Revises: e5b1c7f3a2d9
+Create Date: 2022-07-18 16:02:37.140825
+
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'f7c3d9e1b5a4'
+down_revision = 'e5b1c7f3a2d9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # list_requests, with and without the submitted_by filter
+    op.create_index(
+        'approval_request_project_code_status_submitted_at_idx',
+        'approval_request',
+        ['project_code', 'status', 'submitted_at'],
+        schema='pilot_approval',
+    )
+    op.create_index(
+        'approval_request_project_code_submitted_by_status_idx',
+        'approval_request',
+        ['project_code', 'submitted_by', 'status', 'submitted_at'],
+        schema='pilot_approval',
+    )
+    # list_request_files and the recursive numbering walk children by parent
+    op.create_index(
+        'approval_entity_request_id_parent_id_idx',
+        'approval_entity',
+        ['request_id', 'parent_id'],
+        schema='pilot_approval',
+    )
+    # selected entities in reviews and breadcrumbs
+    op.create_index(
+        'approval_entity_request_id_entity_id_idx',
+        'approval_entity',
+        ['request_id', 'entity_id'],
+        schema='pilot_approval',
+    )
+    # pending files of get_pending, complete_request and review_all_files
+    op.create_index(
+        'approval_entity_request_id_review_status_idx',
+        'approval_entity',
+        ['request_id', 'review_status'],
+        schema='pilot_approval',
+    )
+
+
+def downgrade():
+    op.drop_index('approval_entity_request_id_review_status_idx', table_name='approval_entity', schema='pilot_approval')
+    op.drop_index('approval_entity_request_id_entity_id_idx', table_name='approval_entity', schema='pilot_approval')
+    op.drop_index('approval_entity_request_id_parent_id_idx', table_name='approval_entity', schema='pilot_approval')
+    op.drop_index(
+        'approval_request_project_code_submitted_by_status_idx',
+        table_name='approval_request',
+        schema='pilot_approval',
+    )
+    op.drop_index(
+        'approval_request_project_code_status_submitted_at_idx', table_name='approval_request', schema='pilot_approval'
+    )
@@ -0,0 +1,54 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+
+import pytest
+
+from app.commons.concurrency import gather_with_concurrency
+
+
+@pytest.mark.asyncio
+async def test_gather_with_concurrency_bounds_running_tasks():
+    running = 0
+    peak = 0
+
+    async def work(value: int) -> int:
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+        return value
+
+    result = await gather_with_concurrency(2, *(work(i) for i in range(6)))
+    assert result == [0, 1, 2, 3, 4, 5]
+    assert peak == 2
+
+
+@pytest.mark.asyncio
+async def test_gather_with_concurrency_cancels_on_failure():
+    finished = []
+
+    async def fail():
+        raise ValueError('boom')
+
+    async def slow():
+        await asyncio.sleep(1)
+        finished.append(True)
+
+    with pytest.raises(ValueError):
+        await gather_with_concurrency(2, fail(), slow())
+    await asyncio.sleep(0)
+    assert finished == []
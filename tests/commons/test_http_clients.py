@@ -0,0 +1,40 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+
+from app.commons.http_clients import close_clients, get_client
+from app.config import ConfigClass
+
+
+@pytest.mark.asyncio
+async def test_get_client_reuses_pool_per_service():
+    client = get_client('metadata')
+    assert get_client('metadata') is client
+    assert get_client('auth') is not client
+    assert client.timeout.read == ConfigClass.METADATA_TIMEOUT
+
+    await close_clients()
+    assert client.is_closed
+    assert get_client('metadata') is not client
+
+
+@pytest.mark.asyncio
+async def test_get_client_with_http2(monkeypatch):
+    monkeypatch.setattr(ConfigClass, 'HTTP2_ENABLED', True)
+    await close_clients()
+    client = get_client('email')
+    assert client._transport._pool._http2
+
+    await close_clients()
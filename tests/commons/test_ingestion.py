@@ -0,0 +1,50 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from uuid import uuid4
+
+from app.commons.ingestion import normalize_selection
+from tests.conftest import FILE_DATA, FOLDER_DATA
+
+
+def node(template: dict, parent_path: str, name: str) -> dict:
+    entity = template.copy()
+    entity['id'] = str(uuid4())
+    entity['parent_path'] = parent_path
+    entity['name'] = name
+    return entity
+
+
+def test_normalize_selection_keeps_maximal_subtrees():
+    folder = node(FOLDER_DATA, 'admin', 'folder')
+    sub_folder = node(FOLDER_DATA, 'admin.folder', 'sub_folder')
+    nested_file = node(FILE_DATA, 'admin.folder.sub_folder', 'file')
+    sibling_file = node(FILE_DATA, 'admin', 'folder_file')
+    other_zone = node(FILE_DATA, 'admin.folder', 'file')
+    other_zone['zone'] = 'Core'
+
+    result = normalize_selection([nested_file, sub_folder, folder, sibling_file, folder, other_zone])
+    assert [entity['id'] for entity in result] == [folder['id'], sibling_file['id'], other_zone['id']]
+
+
+def test_normalize_selection_root_level_entities():
+    folder = node(FOLDER_DATA, '', 'admin')
+    nested_file = node(FILE_DATA, 'admin', 'file')
+    assert normalize_selection([nested_file, folder]) == [folder]
+
+
+def test_normalize_selection_dotted_name_next_to_folder():
+    folder = node(FOLDER_DATA, 'admin', 'data')
+    dotted_file = node(FILE_DATA, 'admin', 'data.csv')
+    assert normalize_selection([folder, dotted_file]) == [folder, dotted_file]
@@ -0,0 +1,76 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import json
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+import pytest
+from fastapi_sqlalchemy import db
+
+from app.commons.ingestion import jobs
+from app.models.copy_request_sql import RequestModel
+from app.routers.v1.api_copy_request.request_notify import drain_notifications
+from app.worker import process_ingestion_job, requeue_stale_ingestions
+
+
+@pytest.mark.asyncio
+async def test_dequeued_job_stays_in_processing_until_acked(mocker):
+    redis = mocker.patch.object(jobs, 'redis')
+    item = json.dumps({'request_id': str(uuid4()), 'entity_ids': []})
+    redis.brpoplpush = mocker.AsyncMock(return_value=item)
+    redis.lrem = mocker.AsyncMock()
+
+    assert await jobs.dequeue_ingestion(timeout=1) == item
+    redis.brpoplpush.assert_awaited_once_with(jobs.INGESTION_QUEUE, jobs.INGESTION_PROCESSING, timeout=1)
+    await jobs.ack_ingestion(item)
+    redis.lrem.assert_awaited_once_with(jobs.INGESTION_PROCESSING, 1, item)
+
+
+@pytest.mark.asyncio
+async def test_requeue_stale_ingestions(test_client, mocker):
+    stale_at = datetime.utcnow() - timedelta(days=1)
+    requests = {
+        'stale': RequestModel(id=uuid4(), status='ingesting', ingestion_updated_at=stale_at),
+        'running': RequestModel(id=uuid4(), status='ingesting', ingestion_updated_at=datetime.utcnow()),
+        'done': RequestModel(id=uuid4(), status='pending'),
+    }
+    with db():
+        db.session.add_all(requests.values())
+        db.session.commit()
+        items = {
+            name: json.dumps({'request_id': str(request.id), 'entity_ids': []}) for name, request in requests.items()
+        }
+    mocker.patch('app.worker.get_unacked_ingestions', return_value=list(items.values()))
+    requeue = mocker.patch('app.worker.requeue_ingestion')
+    ack = mocker.patch('app.worker.ack_ingestion')
+
+    await requeue_stale_ingestions()
+    requeue.assert_awaited_once_with(items['stale'])
+    ack.assert_awaited_once_with(items['done'])
+
+
+@pytest.mark.asyncio
+async def test_failed_notification_does_not_fail_ingestion_job(test_client, mocker):
+    request_id = uuid4()
+    with db():
+        db.session.add(RequestModel(id=request_id, status='ingesting', project_code='any', submitted_by='admin'))
+        db.session.commit()
+    mocker.patch('app.worker.bulk_get_by_ids', return_value=[])
+    mocker.patch('app.worker.ingest_request')
+    notify = mocker.patch('app.worker.notify_project_admins', side_effect=Exception('email service is down'))
+
+    await process_ingestion_job({'request_id': str(request_id), 'entity_ids': []})
+    await drain_notifications()
+    notify.assert_awaited_once()
@@ -0,0 +1,43 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+
+from app.commons.meta_services.cache import NodeCache
+
+
+@pytest.mark.asyncio
+async def test_node_cache_local_tier():
+    cache = NodeCache(max_size=2, ttl=60, redis_ttl=60, redis_enabled=False)
+    await cache.set_many([{'id': 'a', 'name': 'a'}, {'id': 'b', 'name': 'b'}])
+
+    found = await cache.get_many(['a', 'c'])
+    assert found == {'a': {'id': 'a', 'name': 'a'}}
+    found['a']['name'] = 'changed'
+    assert (await cache.get_many(['a']))['a']['name'] == 'a'
+
+    # b is the least recently used entry
+    await cache.set_many([{'id': 'c', 'name': 'c'}])
+    assert set(await cache.get_many(['a', 'b', 'c'])) == {'a', 'c'}
+
+    await cache.invalidate(['a'])
+    assert await cache.get_many(['a']) == {}
+    assert cache.stats() == {'local_hits': 4, 'redis_hits': 0, 'misses': 3, 'local_size': 1}
+
+
+@pytest.mark.asyncio
+async def test_node_cache_expires_entries():
+    cache = NodeCache(max_size=2, ttl=0, redis_ttl=60, redis_enabled=False)
+    await cache.set_many([{'id': 'a'}])
+    assert await cache.get_many(['a']) == {}
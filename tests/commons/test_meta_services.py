@@ -0,0 +1,48 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import re
+
+import pytest
+
+from app.commons.meta_services import bulk_get_by_ids
+from app.commons.meta_services.cache import node_cache
+from app.config import ConfigClass
+
+
+@pytest.mark.asyncio
+async def test_bulk_get_by_ids_fetches_in_chunks(httpx_mock, mocker):
+    mocker.patch.object(ConfigClass, 'META_BATCH_SIZE', 2)
+    ids = [f'chunked-{i}' for i in range(5)]
+    for i in range(0, 5, 2):
+        chunk = ids[i:i + 2]
+        query = '&'.join(f'ids={node_id}' for node_id in chunk)
+        url = re.compile('^' + re.escape(ConfigClass.META_SERVICE + 'items/batch/?' + query) + '$')
+        httpx_mock.add_response(method='GET', url=url, json={'result': [{'id': node_id} for node_id in chunk]})
+
+    nodes = await bulk_get_by_ids(ids + ids[:1])
+    assert [node['id'] for node in nodes] == ids
+    assert len(httpx_mock.get_requests()) == 3
+
+
+@pytest.mark.asyncio
+async def test_bulk_get_by_ids_keeps_order_with_cached_nodes(httpx_mock):
+    ids = [f'mixed-{i}' for i in range(4)]
+    await node_cache.set_many([{'id': ids[1]}, {'id': ids[3]}])
+    query = f'ids={ids[0]}&ids={ids[2]}'
+    url = re.compile('^' + re.escape(ConfigClass.META_SERVICE + 'items/batch/?' + query) + '$')
+    httpx_mock.add_response(method='GET', url=url, json={'result': [{'id': ids[2]}, {'id': ids[0]}]})
+
+    nodes = await bulk_get_by_ids(ids)
+    assert [node['id'] for node in nodes] == ids
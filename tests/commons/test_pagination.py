@@ -0,0 +1,36 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from datetime import datetime
+from uuid import uuid4
+
+from sqlalchemy.dialects import postgresql
+
+from app.commons.pagination import decode_cursor, encode_cursor, keyset_filter
+from app.models.copy_request_sql import EntityModel
+
+
+def test_cursor_round_trip():
+    entity_id = uuid4()
+    cursor = encode_cursor(['file', datetime(2022, 7, 1, 12, 30, 0, 5), None, entity_id])
+    assert decode_cursor(cursor, 4) == ['file', '2022-07-01T12:30:00.000005', None, str(entity_id)]
+
+
+def test_keyset_filter_handles_nulls():
+    sort_keys = [(EntityModel.name, False), (EntityModel.id, False)]
+    clause = keyset_filter(sort_keys, [None, str(uuid4())])
+    sql = str(clause.compile(dialect=postgresql.dialect()))
+    # Nothing sorts after null ascending, only rows tied on a null name with a greater id follow
+    assert 'approval_entity.name IS NULL AND' in sql
+    assert 'approval_entity.name >' not in sql
@@ -0,0 +1,29 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import pytest
+
+from app.routers.v1.api_copy_request.request_notify import dispatch_notification
+
+
+@pytest.mark.asyncio
+async def test_dispatch_notification_swallows_errors():
+    calls = []
+
+    async def notify(*args):
+        calls.append(args)
+        raise Exception('email service unavailable')
+
+    await dispatch_notification(notify, 'user', 'project')
+    assert calls == [('user', 'project')]
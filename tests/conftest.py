@@ -12,6 +12,8 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import re
 from uuid import uuid4
 
 import pytest
@@ -23,9 +25,11 @@ from sqlalchemy.schema import CreateSchema, CreateTable
 from sqlalchemy_utils import create_database, database_exists
 from testcontainers.postgres import PostgresContainer
 
+from app.commons.meta_services.cache import node_cache
 from app.config import ConfigClass
 from app.main import create_app
 from app.models.copy_request_sql import Base, EntityModel, RequestModel
+from app.routers.v1.api_copy_request.request_notify import drain_notifications
 
 DEST_FOLDER_ID = str(uuid4())
 SRC_FOLDER_ID = str(uuid4())
@@ -85,6 +89,12 @@ class TestProject:
     time_created = '2021-05-07T16:14:18'
 
 
+@pytest.fixture(autouse=True)
+def clear_node_cache():
+    node_cache.clear()
+    yield
+
+
 @pytest.fixture
 def mock_project(mocker):
     # mock get project
@@ -138,9 +148,35 @@ def mock_dest(httpx_mock):
     )
 
 
+def mock_tree(httpx_mock: HTTPXMock, top_level: list, children: list):
+    """Mock the metadata service for a selection of top_level entities, searches inside folders return children."""
+    url = re.compile('^' + ConfigClass.META_SERVICE + 'items/batch.*$')
+    httpx_mock.add_response(method='GET', url=url, json={'result': top_level})
+    url = re.compile('^' + ConfigClass.META_SERVICE + 'items/search.*$')
+    httpx_mock.add_response(method='GET', url=url, json={'result': children})
+
+
+def create_payload(entity_ids: list) -> dict:
+    return {
+        'entity_ids': entity_ids,
+        'destination_id': DEST_FOLDER_ID,
+        'source_id': SRC_FOLDER_ID,
+        'note': 'testing',
+        'submitted_by': 'admin',
+    }
+
+
+def create_request(test_client, httpx_mock: HTTPXMock, project_code: str, entity_ids: list) -> str:
+    """Create a request from mocked entities and return its id, the project admins are emailed about it."""
+    httpx_mock.add_response(method='POST', url=ConfigClass.EMAIL_SERVICE + 'email/', json={})
+    response = test_client.post(f'/v1/request/copy/{project_code}', json=create_payload(entity_ids))
+    assert response.status_code == 200
+    return response.json()['result']['id']
+
+
 @pytest.fixture(scope='session', autouse=True)
 def db():
-    with PostgresContainer('postgres:9.5') as postgres:
+    with PostgresContainer('postgres:14.1') as postgres:
         postgres_uri = postgres.get_connection_url()
         if not database_exists(postgres_uri):
             create_database(postgres_uri)
@@ -158,4 +194,6 @@ def test_client(db):
     ConfigClass.DB_URI = db.get_connection_url()
     app = create_app()
     client = TestClient(app)
-    return client
+    yield client
+    # Notifications run on tasks of the client's event loop, they're finished before the mocks are checked
+    asyncio.get_event_loop().run_until_complete(drain_notifications())
@@ -347,12 +347,7 @@ def test_complete_pending_400(test_client, httpx_mock, mock_dest, mock_src, mock
     assert response.json()['result']['pending_count'] == 2
 
 
-def test_pending_files_list_200(test_client, httpx_mock):
-    # entity_geids file
-    mock_data = {'result': [FILE_DATA]}
-    url = re.compile('^' + ConfigClass.META_SERVICE + 'items/batch.*$')
-    httpx_mock.add_response(method='GET', url=url, json=mock_data, status_code=200)
-
+def test_pending_files_list_200(test_client):
     payload = {'status': 'pending'}
     response = test_client.get('/v1/request/copy/approval_fake_project', params=payload)
     request_obj = response.json()['result'][0]
@@ -0,0 +1,77 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from datetime import datetime, timedelta
+from uuid import uuid4
+
+from fastapi_sqlalchemy import db
+
+from app.commons.cold_archive import archive_completed_requests
+from app.commons.psql_services import in_request
+from app.config import ConfigClass
+from app.models.copy_request_sql import EntityModel, RequestArchiveModel, RequestModel
+from tests.conftest import FILE_DATA, FOLDER_DATA, create_request, mock_tree
+
+PROJECT_CODE = 'cold_archive_fake_project'
+
+
+def test_completed_request_is_archived_and_rehydrated_on_access_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    children = []
+    for _ in range(2):
+        child = FILE_DATA.copy()
+        child['id'] = str(uuid4())
+        child['parent'] = folder['id']
+        children.append(child)
+    mock_tree(httpx_mock, [folder], children)
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+    payload = {'request_id': request_id, 'review_status': 'denied', 'username': 'admin', 'session_id': 'admin-123'}
+    response = test_client.put(f'/v1/request/copy/{PROJECT_CODE}/files', json=payload)
+    assert response.status_code == 200
+    payload = {'request_id': request_id, 'status': 'complete', 'username': 'admin'}
+    response = test_client.put(f'/v1/request/copy/{PROJECT_CODE}', json=payload)
+    assert response.status_code == 200
+    params = {'request_id': request_id, 'parent_id': folder['id']}
+    before = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=params).json()['result']
+
+    with db():
+        completed_at = datetime.utcnow() - timedelta(days=ConfigClass.COLD_ARCHIVE_AFTER_DAYS + 1)
+        db.session.query(RequestModel).filter_by(id=request_id).update({'completed_at': completed_at})
+        db.session.commit()
+        assert archive_completed_requests(10) >= 1
+        assert db.session.query(EntityModel).filter(in_request(request_id)).count() == 0
+        assert db.session.query(RequestArchiveModel).get(request_id).entity_count == 3
+
+    # The request row stays behind as a stub, listings don't need the entities
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}', params={'status': 'complete'})
+    listed = {request['id']: request for request in response.json()['result']}
+    assert listed[request_id]['cold_archived_at']
+
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=params)
+    assert response.status_code == 200
+    assert response.json()['result'] == before
+    with db():
+        assert db.session.query(RequestArchiveModel).get(request_id) is None
+        assert db.session.query(RequestModel).get(request_id).cold_archived_at is None
+
+    # Rehydrated entities are being read again, the next pass leaves them alone
+    with db():
+        archive_completed_requests(10)
+        request_obj = db.session.query(RequestModel).get(request_id)
+        assert request_obj.cold_archived_at is None
+        assert request_obj.rehydrated_at
+        assert db.session.query(EntityModel).filter(in_request(request_id)).count() == 3
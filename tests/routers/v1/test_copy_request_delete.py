@@ -0,0 +1,135 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from datetime import datetime
+from uuid import uuid4
+
+from fastapi_sqlalchemy import db
+
+from app.commons.psql_services import (
+    fail_ingestion,
+    finish_ingestion,
+    mark_deleting,
+    purge_deleted_requests,
+)
+from app.config import ConfigClass
+from app.models.copy_request_sql import (
+    EntityModel,
+    IngestionCheckpointModel,
+    RequestModel,
+    RequestSummaryModel,
+)
+from tests.conftest import FILE_DATA, FOLDER_DATA, create_request, mock_tree
+
+PROJECT_CODE = 'delete_fake_project'
+
+
+def create_folder_request(test_client, httpx_mock) -> str:
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    children = []
+    for _ in range(4):
+        child = FILE_DATA.copy()
+        child['id'] = str(uuid4())
+        child['parent'] = folder['id']
+        children.append(child)
+    mock_tree(httpx_mock, [folder], children)
+    return create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+
+def assert_purged(request_id: str):
+    with db():
+        assert db.session.query(RequestModel).get(request_id) is None
+        assert db.session.query(EntityModel).filter_by(request_id=request_id).count() == 0
+        assert db.session.query(RequestSummaryModel).filter_by(request_id=request_id).count() == 0
+        assert db.session.query(IngestionCheckpointModel).filter_by(request_id=request_id).count() == 0
+
+
+def test_delete_request_cascades_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    request_id = create_folder_request(test_client, httpx_mock)
+    with db():
+        assert db.session.query(IngestionCheckpointModel).filter_by(request_id=request_id).count() == 1
+
+    response = test_client.delete(f'/v1/request/copy/{PROJECT_CODE}/delete/{request_id}')
+    assert response.status_code == 200
+    assert_purged(request_id)
+
+
+def test_delete_large_request_is_purged_in_background_200(
+    test_client, httpx_mock, monkeypatch, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    request_id = create_folder_request(test_client, httpx_mock)
+    monkeypatch.setattr(ConfigClass, 'DELETE_INLINE_LIMIT', 1)
+    monkeypatch.setattr(ConfigClass, 'PURGE_BATCH_SIZE', 2)
+
+    response = test_client.delete(f'/v1/request/copy/{PROJECT_CODE}/delete/{request_id}')
+    assert response.status_code == 200
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}', params={'status': 'pending'})
+    assert request_id not in [request['id'] for request in response.json()['result']]
+    with db():
+        assert db.session.query(RequestModel).get(request_id).status == 'deleting'
+        assert db.session.query(EntityModel).filter_by(request_id=request_id).count() == 5
+
+        assert purge_deleted_requests() == 1
+    assert_purged(request_id)
+
+
+def test_delete_request_being_ingested_409(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    request_id = create_folder_request(test_client, httpx_mock)
+    with db():
+        request_obj = db.session.query(RequestModel).get(request_id)
+        request_obj.status = 'ingesting'
+        request_obj.ingestion_updated_at = datetime.utcnow()
+        db.session.commit()
+
+    response = test_client.delete(f'/v1/request/copy/{PROJECT_CODE}/delete/{request_id}')
+    assert response.status_code == 409
+    with db():
+        assert db.session.query(RequestModel).get(request_id).status == 'ingesting'
+        assert db.session.query(EntityModel).filter_by(request_id=request_id).count() == 5
+
+
+def test_deleting_request_is_not_found_404(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    request_id = create_folder_request(test_client, httpx_mock)
+    with db():
+        mark_deleting(request_id)
+
+    params = {'request_id': request_id}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=params)
+    assert response.status_code == 404
+    payload = {'request_id': request_id, 'review_status': 'denied', 'session_id': 'test', 'username': 'admin'}
+    response = test_client.put(f'/v1/request/copy/{PROJECT_CODE}/files', json=payload)
+    assert response.status_code == 404
+    response = test_client.patch(f'/v1/request/copy/{PROJECT_CODE}/files', json={**payload, 'entity_ids': []})
+    assert response.status_code == 404
+    payload = {'request_id': request_id, 'status': 'complete', 'username': 'admin'}
+    response = test_client.put(f'/v1/request/copy/{PROJECT_CODE}', json=payload)
+    assert response.status_code == 404
+
+
+def test_ingestion_end_keeps_deleting_status(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    request_id = create_folder_request(test_client, httpx_mock)
+    with db():
+        mark_deleting(request_id)
+        assert not finish_ingestion(request_id)
+        fail_ingestion(request_id)
+        assert db.session.query(RequestModel).get(request_id).status == 'deleting'
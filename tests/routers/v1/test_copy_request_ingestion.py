@@ -0,0 +1,367 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import re
+from uuid import UUID, uuid4
+
+import pytest
+from fastapi_sqlalchemy import db
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app.commons.ingestion.jobs import IngestionProgress
+from app.commons.psql_services import finish_ingestion
+from app.config import ConfigClass
+from app.models.copy_request_sql import EntityModel, RequestModel, RequestSummaryModel
+from app.routers.v1.api_copy_request.request_notify import drain_notifications
+from app.worker import process_ingestion_job
+from tests.conftest import (
+    FILE_DATA,
+    FOLDER_DATA,
+    create_payload,
+    create_request,
+    mock_tree,
+)
+
+PROJECT_CODE = 'ingestion_fake_project'
+
+
+def test_create_request_batches_entities_200(
+    test_client, httpx_mock, mocker, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    mocker.patch.object(ConfigClass, 'ENTITY_INSERT_BATCH_SIZE', 2)
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    children = []
+    for i in range(5):
+        child = FILE_DATA.copy()
+        child['id'] = str(uuid4())
+        child['name'] = f'batch_file_{i}'
+        child['parent'] = folder['id']
+        children.append(child)
+    mock_tree(httpx_mock, [folder], children)
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+    payload = {'request_id': request_id, 'parent_id': folder['id']}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=payload)
+    assert response.status_code == 200
+    assert response.json()['total'] == 5
+
+
+def test_create_request_failure_is_not_listed_as_pending(test_client, httpx_mock, mock_src, mock_dest):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    broken = FILE_DATA.copy()
+    broken['id'] = str(uuid4())
+    del broken['owner']
+    mock_tree(httpx_mock, [folder], [broken])
+    pending_total = test_client.get(f'/v1/request/copy/{PROJECT_CODE}', params={'status': 'pending'}).json()['total']
+    failed_total = test_client.get(f'/v1/request/copy/{PROJECT_CODE}', params={'status': 'failed'}).json()['total']
+
+    with pytest.raises(KeyError):
+        test_client.post(f'/v1/request/copy/{PROJECT_CODE}', json=create_payload([folder['id']]))
+
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}', params={'status': 'pending'})
+    assert response.json()['total'] == pending_total
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}', params={'status': 'failed'})
+    assert response.json()['total'] == failed_total + 1
+
+
+def test_create_request_pages_through_search_200(
+    test_client, httpx_mock, mocker, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    mocker.patch.object(ConfigClass, 'META_SEARCH_PAGE_SIZE', 2)
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    children = []
+    for i in range(5):
+        child = FILE_DATA.copy()
+        child['id'] = str(uuid4())
+        child['name'] = f'paged_file_{i}'
+        child['parent'] = folder['id']
+        children.append(child)
+
+    url = re.compile('^' + ConfigClass.META_SERVICE + 'items/batch.*$')
+    httpx_mock.add_response(method='GET', url=url, json={'result': [folder]}, status_code=200)
+    for page in range(3):
+        url = re.compile('^' + ConfigClass.META_SERVICE + f'items/search/.*[?&]page={page}(&.*)?$')
+        mock_data = {'result': children[page * 2:page * 2 + 2], 'num_of_pages': 3}
+        httpx_mock.add_response(method='GET', url=url, json=mock_data, status_code=200)
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+    payload = {'request_id': request_id, 'parent_id': folder['id']}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=payload)
+    assert response.status_code == 200
+    assert response.json()['total'] == 5
+
+
+def test_create_request_async_202(
+    test_client, httpx_mock, mocker, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    enqueue = mocker.patch('app.routers.v1.api_copy_request.api_copy_request.enqueue_ingestion')
+    mocker.patch.object(IngestionProgress, 'save')
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    child = FILE_DATA.copy()
+    child['id'] = str(uuid4())
+    child['parent'] = folder['id']
+    mock_tree(httpx_mock, [folder], [child])
+    httpx_mock.add_response(method='POST', url=ConfigClass.EMAIL_SERVICE + 'email/', json={})
+
+    payload = create_payload([folder['id']])
+    payload['ingest_async'] = True
+    response = test_client.post(f'/v1/request/copy/{PROJECT_CODE}', json=payload)
+    assert response.status_code == 202
+    assert response.json()['result']['status'] == 'ingesting'
+    request_id = response.json()['result']['id']
+    enqueue.assert_called_once_with(UUID(request_id), [folder['id']])
+
+    # Nothing can be reviewed or completed before the worker has ingested the files
+    review = {'request_id': request_id, 'review_status': 'approved', 'session_id': 'test', 'username': 'admin'}
+    response = test_client.put(f'/v1/request/copy/{PROJECT_CODE}/files', json=review)
+    assert response.status_code == 409
+    response = test_client.patch(f'/v1/request/copy/{PROJECT_CODE}/files', json={**review, 'entity_ids': []})
+    assert response.status_code == 409
+    complete = {'request_id': request_id, 'status': 'complete', 'username': 'admin'}
+    response = test_client.put(f'/v1/request/copy/{PROJECT_CODE}', json=complete)
+    assert response.status_code == 409
+
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(process_ingestion_job({'request_id': request_id, 'entity_ids': [folder['id']]}))
+    loop.run_until_complete(drain_notifications())
+    loop.close()
+
+    progress = {'files_total': 2, 'files_ingested': 2, 'bytes_ingested': 123, 'eta_seconds': None, 'error': ''}
+    mocker.patch('app.routers.v1.api_copy_request.api_copy_request.get_progress', return_value=progress)
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/ingestion/{request_id}')
+    assert response.status_code == 200
+    assert response.json()['result']['status'] == 'pending'
+    assert response.json()['result']['files_ingested'] == 2
+    assert response.json()['result']['eta_seconds'] == 0
+
+    payload = {'request_id': request_id, 'parent_id': folder['id']}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=payload)
+    assert response.json()['total'] == 1
+
+
+def test_get_ingestion_404(test_client):
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/ingestion/{uuid4()}')
+    assert response.status_code == 404
+
+
+def test_create_request_resumes_with_idempotency_key_200(
+    test_client, httpx_mock, mocker, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    mocker.patch.object(ConfigClass, 'META_SEARCH_PAGE_SIZE', 2)
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    children = []
+    for i in range(3):
+        child = FILE_DATA.copy()
+        child['id'] = str(uuid4())
+        child['name'] = f'resumed_file_{i}'
+        child['parent'] = folder['id']
+        children.append(child)
+
+    url = re.compile('^' + ConfigClass.META_SERVICE + 'items/batch.*$')
+    httpx_mock.add_response(method='GET', url=url, json={'result': [folder]}, status_code=200)
+    first_page = re.compile('^' + ConfigClass.META_SERVICE + 'items/search/.*[?&]page=0(&.*)?$')
+    httpx_mock.add_response(method='GET', url=first_page, json={'result': children[:2], 'num_of_pages': 2})
+    second_page = re.compile('^' + ConfigClass.META_SERVICE + 'items/search/.*[?&]page=1(&.*)?$')
+    httpx_mock.add_response(method='GET', url=second_page, json={'error': 'unavailable'}, status_code=500)
+    httpx_mock.add_response(method='GET', url=second_page, json={'result': children[2:], 'num_of_pages': 2})
+    httpx_mock.add_response(method='POST', url=ConfigClass.EMAIL_SERVICE + 'email/', json={})
+
+    headers = {'Idempotency-Key': str(uuid4())}
+    response = test_client.post(
+        f'/v1/request/copy/{PROJECT_CODE}', json=create_payload([folder['id']]), headers=headers
+    )
+    assert response.status_code == 500
+
+    response = test_client.post(
+        f'/v1/request/copy/{PROJECT_CODE}', json=create_payload([folder['id']]), headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()['result']['status'] == 'pending'
+    request_id = response.json()['result']['id']
+    assert len(httpx_mock.get_requests(url=first_page)) == 1
+
+    response = test_client.post(
+        f'/v1/request/copy/{PROJECT_CODE}', json=create_payload([folder['id']]), headers=headers
+    )
+    assert response.status_code == 200
+    assert response.json()['result']['id'] == request_id
+
+    payload = {'request_id': request_id, 'parent_id': folder['id']}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=payload)
+    assert response.json()['total'] == 3
+
+
+def test_create_request_overlapping_selection_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    folder['name'] = 'selected_folder'
+    nested = FILE_DATA.copy()
+    nested['id'] = str(uuid4())
+    nested['parent_path'] = 'fake.path.selected_folder'
+    nested['parent'] = folder['id']
+    mock_tree(httpx_mock, [nested, folder], [nested])
+
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [nested['id'], folder['id']])
+    assert len(httpx_mock.get_requests(url=re.compile('^' + ConfigClass.META_SERVICE + 'items/search.*$'))) == 1
+
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params={'request_id': request_id})
+    assert response.json()['total'] == 1
+    response = test_client.get(
+        f'/v1/request/copy/{PROJECT_CODE}/files', params={'request_id': request_id, 'parent_id': folder['id']}
+    )
+    assert response.json()['total'] == 1
+
+
+def test_create_request_uses_node_cache_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    mock_tree(httpx_mock, [folder], [])
+    httpx_mock.add_response(method='POST', url=ConfigClass.EMAIL_SERVICE + 'email/', json={})
+    local_hits = test_client.get('/v1/health/cache/').json()['local_hits']
+
+    for _ in range(2):
+        response = test_client.post(f'/v1/request/copy/{PROJECT_CODE}', json=create_payload([folder['id']]))
+        assert response.status_code == 200
+    assert len(httpx_mock.get_requests(url=re.compile('^' + ConfigClass.META_SERVICE + 'item/.*$'))) == 2
+    assert len(httpx_mock.get_requests(url=re.compile('^' + ConfigClass.META_SERVICE + 'items/batch.*$'))) == 1
+
+    response = test_client.get('/v1/health/cache/')
+    assert response.json()['local_hits'] == local_hits + 3
+
+
+def test_review_nested_folders_in_single_query_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    descendants = []
+    parent_id = folder['id']
+    for depth in range(5):
+        sub_folder = FOLDER_DATA.copy()
+        sub_folder['id'] = str(uuid4())
+        sub_folder['name'] = f'nested_folder_{depth}'
+        sub_folder['parent'] = parent_id
+        child = FILE_DATA.copy()
+        child['id'] = str(uuid4())
+        child['name'] = f'nested_file_{depth}'
+        child['parent'] = sub_folder['id']
+        descendants += [sub_folder, child]
+        parent_id = sub_folder['id']
+    mock_tree(httpx_mock, [folder], descendants)
+
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'before_cursor_execute', capture)
+    try:
+        payload = {
+            'entity_ids': [folder['id']],
+            'request_id': request_id,
+            'review_status': 'denied',
+            'username': 'admin',
+            'session_id': 'admin-123',
+        }
+        response = test_client.patch(f'/v1/request/copy/{PROJECT_CODE}/files', json=payload)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', capture)
+    assert response.status_code == 200
+    assert response.json()['result'] == {'updated': 5, 'approved': 0, 'denied': 0}
+    # review statuses are counted in one aggregation, the review is a single UPDATE
+    aggregations = [statement for statement in statements if statement.startswith('SELECT') and 'GROUP BY' in statement]
+    assert len(aggregations) == 1
+    updates = [statement for statement in statements if 'UPDATE' in statement]
+    assert len(updates) == 1
+    assert 'approval_entity.lft <=' in updates[0]
+    assert len([statement for statement in statements if 'approval_entity' in statement]) == 2
+
+    response = test_client.patch(f'/v1/request/copy/{PROJECT_CODE}/files', json=payload)
+    assert response.json()['result'] == {'updated': 0, 'approved': 0, 'denied': 5}
+
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params={'request_id': request_id})
+    top_folder = response.json()['result']['data'][0]
+    assert top_folder['entity_id'] == folder['id']
+    assert (top_folder['pending_count'], top_folder['denied_count'], top_folder['total_size']) == (0, 5, 5 * 123)
+
+    with db():
+        summary = db.session.query(RequestSummaryModel).get(request_id)
+        assert (summary.file_count, summary.pending_count, summary.denied_count) == (5, 0, 5)
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/pending-files', params={'request_id': request_id})
+    assert response.json()['result'] == {'pending_entities': [], 'pending_count': 0}
+
+
+def test_create_request_numbers_entity_tree_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    sub_folder = FOLDER_DATA.copy()
+    sub_folder['id'] = str(uuid4())
+    sub_folder['parent'] = folder['id']
+    nested = FILE_DATA.copy()
+    nested['id'] = str(uuid4())
+    nested['parent'] = sub_folder['id']
+    child = FILE_DATA.copy()
+    child['id'] = str(uuid4())
+    child['parent'] = folder['id']
+    mock_tree(httpx_mock, [folder], [sub_folder, nested, child])
+
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+    with db():
+        rows = db.session.query(EntityModel).filter_by(request_id=request_id)
+        entities = {str(row.entity_id): row for row in rows}
+    assert sorted(row.lft for row in entities.values()) == [1, 2, 3, 4]
+    assert (entities[folder['id']].lft, entities[folder['id']].rgt, entities[folder['id']].depth) == (1, 4, 0)
+    assert entities[sub_folder['id']].rgt == entities[sub_folder['id']].lft + 1
+    assert entities[nested['id']].lft == entities[sub_folder['id']].lft + 1
+    assert entities[nested['id']].depth == 2
+    assert entities[child['id']].lft == entities[child['id']].rgt
+    assert entities[child['id']].depth == 1
+    assert (entities[folder['id']].pending_count, entities[folder['id']].total_size) == (2, 246)
+    assert entities[sub_folder['id']].pending_count == 1
+
+    payload = {'request_id': request_id, 'parent_id': sub_folder['id']}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=payload)
+    assert response.status_code == 200
+    assert [entity['entity_id'] for entity in response.json()['result']['routing']] == [sub_folder['id'], folder['id']]
+
+
+def test_ingestion_end_only_moves_ingesting_requests(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    mock_tree(httpx_mock, [folder], [])
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+    with db():
+        db.session.query(RequestModel).filter_by(id=request_id).update({'status': 'complete'})
+        db.session.commit()
+        assert not finish_ingestion(request_id)
+        assert db.session.query(RequestModel).get(request_id).status == 'complete'
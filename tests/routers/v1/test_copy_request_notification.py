@@ -0,0 +1,83 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import asyncio
+import json
+from uuid import uuid4
+
+import pytest
+
+from app.config import ConfigClass
+from app.main import create_app
+from app.routers.v1.api_copy_request import request_notify
+from tests.conftest import FILE_DATA, create_payload, mock_tree
+
+PROJECT_CODE = 'notification_fake_project'
+
+
+@pytest.mark.asyncio
+async def test_create_request_responds_before_admins_are_notified(
+    db, httpx_mock, mocker, mock_project, mock_src, mock_dest
+):
+    ConfigClass.DB_URI = db.get_connection_url()
+    file = FILE_DATA.copy()
+    file['id'] = str(uuid4())
+    mock_tree(httpx_mock, [file], [])
+
+    release = asyncio.Event()
+    notified = []
+
+    async def notify_project_admins(*args):
+        await release.wait()
+        notified.append(args)
+
+    mocker.patch(
+        'app.routers.v1.api_copy_request.api_copy_request.notify_project_admins', notify_project_admins
+    )
+    body = json.dumps(create_payload([file['id']])).encode()
+    scope = {
+        'type': 'http',
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': f'/v1/request/copy/{PROJECT_CODE}',
+        'root_path': '',
+        'query_string': b'',
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json')],
+        'client': ('testclient', 50000),
+        'server': ('testserver', 80),
+    }
+    messages = []
+    requests = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    disconnected = asyncio.Event()
+
+    async def receive():
+        if requests:
+            return requests.pop()
+        # Like a live connection, nothing more arrives until the client goes away
+        await disconnected.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    # The whole ASGI app runs, middleware included, the response has to be complete while the email is held
+    await asyncio.wait_for(create_app()(scope, receive, send), 5)
+    assert messages[0]['status'] == 200
+    assert messages[-1]['type'] == 'http.response.body' and not messages[-1].get('more_body')
+    assert notified == []
+
+    release.set()
+    await request_notify.drain_notifications()
+    assert notified[0][0] == 'admin'
@@ -0,0 +1,130 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from uuid import uuid4
+
+from fastapi_sqlalchemy import db
+
+from app.commons.pagination import estimate_count
+from app.commons.psql_services import in_request
+from app.models.copy_request_sql import EntityModel
+from tests.conftest import FILE_DATA, FOLDER_DATA, create_request, mock_tree
+
+PROJECT_CODE = 'pagination_fake_project'
+
+
+def test_list_request_files_cursor_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    children = []
+    for i in range(5):
+        child = FILE_DATA.copy()
+        child['id'] = str(uuid4())
+        child['name'] = f'cursor_file_{i % 2}'
+        child['parent'] = folder['id']
+        children.append(child)
+    mock_tree(httpx_mock, [folder], children)
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+    params = {'request_id': request_id, 'parent_id': folder['id'], 'order_by': 'name', 'page_size': 5}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=params)
+    expected = [entity['id'] for entity in response.json()['result']['data']]
+    assert response.json()['next_cursor'] is None
+
+    entity_ids = []
+    params['page_size'] = 2
+    while True:
+        response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=params)
+        assert response.status_code == 200
+        entity_ids += [entity['id'] for entity in response.json()['result']['data']]
+        if not response.json()['next_cursor']:
+            break
+        params['cursor'] = response.json()['next_cursor']
+    assert entity_ids == expected
+    assert len(entity_ids) == 5
+
+
+def test_list_requests_cursor_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    mock_tree(httpx_mock, [folder], [])
+    # A project of its own so requests of other tests don't show up in the listing
+    project_code = 'pagination_requests_fake_project'
+    request_ids = [create_request(test_client, httpx_mock, project_code, [folder['id']]) for _ in range(3)]
+
+    params = {'status': 'pending', 'submitted_by': 'admin', 'page_size': 2}
+    response = test_client.get(f'/v1/request/copy/{project_code}', params=params)
+    first_page = [request['id'] for request in response.json()['result']]
+    params['cursor'] = response.json()['next_cursor']
+    response = test_client.get(f'/v1/request/copy/{project_code}', params=params)
+    second_page = [request['id'] for request in response.json()['result']]
+    assert first_page + second_page == request_ids[::-1]
+    assert response.json()['next_cursor'] is None
+
+
+def test_list_requests_invalid_cursor_400(test_client):
+    params = {'status': 'pending', 'cursor': 'not-a-cursor'}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}', params=params)
+    assert response.status_code == 400
+
+
+def test_list_request_files_count_modes_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    children = []
+    for _ in range(3):
+        child = FILE_DATA.copy()
+        child['id'] = str(uuid4())
+        child['parent'] = folder['id']
+        children.append(child)
+    mock_tree(httpx_mock, [folder], children)
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+    params = {'request_id': request_id, 'parent_id': folder['id'], 'page_size': 2, 'page': 1, 'count_mode': 'window'}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=params)
+    assert response.status_code == 200
+    assert len(response.json()['result']['data']) == 1
+    assert response.json()['total'] == 3
+    assert response.json()['num_of_pages'] == 2
+
+    # Past the last page there's no row to count over, the total is still the real one
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params={**params, 'page': 5})
+    assert response.json()['result']['data'] == []
+    assert response.json()['total'] == 3
+    assert response.json()['num_of_pages'] == 2
+
+    first_page = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params={**params, 'page': 0})
+    cursor = first_page.json()['next_cursor']
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params={**params, 'cursor': cursor})
+    assert response.status_code == 400
+
+    params['count_mode'] = 'estimate'
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=params)
+    assert response.status_code == 200
+    # The planner's guess for the listing query, not the exact count
+    with db():
+        query = db.session.query(EntityModel).filter(in_request(request_id))
+        expected = estimate_count(query.filter_by(request_id=request_id, parent_id=folder['id']))
+    assert response.json()['total'] == expected
+    assert response.json()['total'] > 0
+
+    params['count_mode'] = 'unknown'
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=params)
+    assert response.status_code == 422
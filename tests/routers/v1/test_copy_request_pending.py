@@ -0,0 +1,87 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+import re
+from uuid import uuid4
+
+from fastapi_sqlalchemy import db
+
+from app.config import ConfigClass
+from app.models.copy_request_sql import EntityModel, RequestModel
+from tests.conftest import FILE_DATA, create_request, mock_tree
+
+PROJECT_CODE = 'pending_fake_project'
+
+
+def test_get_pending_reconciles_stale_archived_flags_200(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    kept = FILE_DATA.copy()
+    kept['id'] = str(uuid4())
+    archived = FILE_DATA.copy()
+    archived['id'] = str(uuid4())
+    batch_url = re.compile('^' + ConfigClass.META_SERVICE + 'items/batch.*$')
+    httpx_mock.add_response(method='GET', url=batch_url, json={'result': [kept, archived]})
+    httpx_mock.add_response(method='GET', url=batch_url, json={'result': [kept, {**archived, 'archived': True}]})
+    url = re.compile('^' + ConfigClass.META_SERVICE + 'items/search.*$')
+    httpx_mock.add_response(method='GET', url=url, json={'result': []})
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [kept['id'], archived['id']])
+
+    # Freshly ingested flags are answered locally
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/pending-files', params={'request_id': request_id})
+    assert response.json()['result']['pending_count'] == 2
+    assert len(httpx_mock.get_requests(url=batch_url)) == 1
+
+    with db():
+        db.session.query(RequestModel).filter_by(id=request_id).update({'archive_checked_at': None})
+        db.session.commit()
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/pending-files', params={'request_id': request_id})
+    assert response.json()['result'] == {'pending_entities': [kept['id']], 'pending_count': 1}
+    assert len(httpx_mock.get_requests(url=batch_url)) == 2
+
+    with db():
+        entity = db.session.query(EntityModel).filter_by(request_id=request_id, entity_id=archived['id']).one()
+        assert entity.archived
+        assert db.session.query(RequestModel).get(request_id).archive_checked_at
+
+
+def test_pending_files_are_paged_and_counted_200(
+    test_client, httpx_mock, monkeypatch, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    files = []
+    for _ in range(3):
+        file = FILE_DATA.copy()
+        file['id'] = str(uuid4())
+        files.append(file)
+    mock_tree(httpx_mock, files, [])
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [file['id'] for file in files])
+
+    monkeypatch.setattr(ConfigClass, 'PENDING_PAGE_SIZE', 2)
+    payload = {'request_id': request_id, 'status': 'complete', 'username': 'admin'}
+    response = test_client.put(f'/v1/request/copy/{PROJECT_CODE}', json=payload)
+    assert response.status_code == 400
+    assert response.json()['result']['pending_count'] == 3
+    assert len(response.json()['result']['pending_entities']) == 2
+
+    params = {'request_id': request_id, 'page_size': 5}
+    pending_entities = []
+    while True:
+        response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/pending-files', params=params)
+        assert response.json()['result']['pending_count'] == 3
+        assert len(response.json()['result']['pending_entities']) <= 2
+        pending_entities += response.json()['result']['pending_entities']
+        if not response.json()['next_cursor']:
+            break
+        params['cursor'] = response.json()['next_cursor']
+    assert sorted(pending_entities) == sorted(file['id'] for file in files)
@@ -0,0 +1,148 @@
+# Copyright (C) 2022 Indoc Research
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as
+# published by the Free Software Foundation, either version 3 of the
+# License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+from uuid import uuid4
+
+import pytest
+from fastapi_sqlalchemy import db
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine
+
+from app.commons.psql_services import in_request
+from app.config import ConfigClass
+from app.models.copy_request_sql import EntityModel
+from tests.conftest import FILE_DATA, FOLDER_DATA, create_request, mock_tree
+
+PROJECT_CODE = 'query_plan_fake_project'
+
+
+def find_full_scans(plan: dict) -> list[str]:
+    # An index scan without a condition reads the whole index, it's a seq scan in disguise
+    scans = []
+    if plan['Node Type'] == 'Seq Scan':
+        scans.append(plan['Relation Name'])
+    elif plan['Node Type'] in ['Index Scan', 'Index Only Scan'] and 'Index Cond' not in plan:
+        scans.append(plan['Relation Name'])
+    for sub_plan in plan.get('Plans', []):
+        scans += find_full_scans(sub_plan)
+    return scans
+
+
+def find_executed_partitions(plan: dict) -> list[str]:
+    # Partitions pruned at execution time stay in the plan but are never executed
+    partitions = []
+    if plan.get('Relation Name', '').startswith('approval_entity_p') and plan['Actual Loops']:
+        partitions.append(plan['Relation Name'])
+    for sub_plan in plan.get('Plans', []):
+        partitions += find_executed_partitions(sub_plan)
+    return partitions
+
+
+@pytest.fixture
+def explain_queries(test_client):
+    """Capture every statement run while the test calls endpoints and EXPLAIN them when it's done.
+
+    With sequential scans disabled the planner only picks one when no index matches the query.
+    """
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+            statements.append((statement, parameters))
+
+    event.listen(Engine, 'before_cursor_execute', capture)
+    yield statements
+    event.remove(Engine, 'before_cursor_execute', capture)
+
+    engine = create_engine(ConfigClass.DB_URI)
+    with engine.connect() as connection:
+        connection.exec_driver_sql('SET enable_seqscan = off')
+        for statement, parameters in statements:
+            plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+            assert find_full_scans(plan[0]['Plan']) == [], statement
+    engine.dispose()
+    assert statements
+
+
+def test_endpoint_query_plans_use_indexes(
+    explain_queries, test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    sub_folder = FOLDER_DATA.copy()
+    sub_folder['id'] = str(uuid4())
+    sub_folder['parent'] = folder['id']
+    child = FILE_DATA.copy()
+    child['id'] = str(uuid4())
+    child['parent'] = sub_folder['id']
+    mock_tree(httpx_mock, [folder], [sub_folder, child])
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}', params={'status': 'pending'})
+    assert response.status_code == 200
+    params = {'status': 'pending', 'submitted_by': 'admin'}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}', params=params)
+    assert response.status_code == 200
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params={'request_id': request_id})
+    assert response.status_code == 200
+    payload = {'request_id': request_id, 'parent_id': sub_folder['id']}
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/files', params=payload)
+    assert response.status_code == 200
+
+    payload = {
+        'entity_ids': [sub_folder['id']],
+        'request_id': request_id,
+        'review_status': 'denied',
+        'username': 'admin',
+        'session_id': 'admin-123',
+    }
+    response = test_client.patch(f'/v1/request/copy/{PROJECT_CODE}/files', json=payload)
+    assert response.status_code == 200
+    payload = {
+        'request_id': request_id,
+        'review_status': 'denied',
+        'username': 'admin',
+        'session_id': 'admin-123',
+    }
+    response = test_client.put(f'/v1/request/copy/{PROJECT_CODE}/files', json=payload)
+    assert response.status_code == 200
+
+    response = test_client.get(f'/v1/request/copy/{PROJECT_CODE}/pending-files', params={'request_id': request_id})
+    assert response.status_code == 200
+    payload = {
+        'request_id': request_id,
+        'session_id': 'admin-123',
+        'status': 'complete',
+        'review_notes': 'done',
+        'username': 'admin',
+    }
+    response = test_client.put(f'/v1/request/copy/{PROJECT_CODE}', json=payload)
+    assert response.status_code == 200
+
+
+def test_entity_queries_prune_other_project_partitions(
+    test_client, httpx_mock, mock_project, mock_src, mock_dest, mock_user, mock_roles
+):
+    folder = FOLDER_DATA.copy()
+    folder['id'] = str(uuid4())
+    mock_tree(httpx_mock, [folder], [])
+    request_id = create_request(test_client, httpx_mock, PROJECT_CODE, [folder['id']])
+
+    with db():
+        query = db.session.query(EntityModel).filter(in_request(request_id))
+        compiled = query.statement.compile(dialect=db.session.bind.dialect)
+        plan = db.session.connection().exec_driver_sql(
+            'EXPLAIN (ANALYZE, FORMAT JSON) ' + str(compiled), compiled.params
+        ).scalar()
+    assert len(find_executed_partitions(plan[0]['Plan'])) == 1